@@ -4,7 +4,8 @@ Flask Backend for Cattle vs Buffalo Classification
 Serves the trained ML model via REST API
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify, g, Response
+from werkzeug.exceptions import RequestEntityTooLarge
 from flask_cors import CORS
 import base64
 import io
@@ -12,249 +13,897 @@ import cv2
 import numpy as np
 import joblib
 import json
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
 from pathlib import Path
 import logging
 
+from features import (
+    extract_features, extract_features_batch, is_compatible,
+    FEATURE_EXTRACTOR_VERSION, FEATURE_PROFILES, DEFAULT_PROFILE, CASCADE_PROFILE, IMAGE_SIZE
+)
+from image_decode import decode_image
+from result_cache import ResultCache
+from video import classify_video
+from inference_scheduler import MicroBatchScheduler, BATCH_SIZE_BUCKETS, QUEUE_WAIT_BUCKETS_MS
+from metrics import REGISTRY, CONTENT_TYPE, Counter, Gauge, Histogram, format_histogram
+from model_artifact import (
+    artifact_path, cascade_model_path, load_artifact, load_model_file, mapped_bytes, current_rss_mb,
+    compile_model, is_forest, predict_with_proba, MANIFEST_FILE
+)
+from model_registry import ModelRegistry, RegistryWatcher, DEFAULT_REGISTRY
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class UploadRequest(Request):
+    """Request with a body size limit for video uploads
+    
+    Werkzeug enforces the limit while reading the body, also when the
+    client sends no Content-Length (chunked uploads), and raises
+    RequestEntityTooLarge once it is exceeded.
+    """
+    
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'classify_video_upload':
+            return MAX_VIDEO_BYTES
+        return super().max_content_length
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 CORS(app)  # Enable CORS for frontend integration
 
-# Global variables for model
-model = None
-metadata = None
+# Model used when the registry has no active version
+DEFAULT_MODEL_PATH = "cattle_buffalo_model"
+
+# The model being served (a ServingModel); replaced as a whole on reload
+serving = None
+
+# Cascade first stage (colour histograms only), used when the model metadata has one
+CASCADE_ENABLED = os.environ.get('CASCADE', '1') == '1'
+
+# Compile joblib forests into flat node arrays at load (COMPILED_FOREST=0 serves them with sklearn)
+COMPILED_FOREST = os.environ.get('COMPILED_FOREST', '1') == '1'
+
+# Versioned models; the active version is loaded at startup and followed at runtime
+model_registry = ModelRegistry(os.environ.get('MODEL_REGISTRY', DEFAULT_REGISTRY))
+MODEL_RELOAD_INTERVAL = float(os.environ.get('MODEL_RELOAD_INTERVAL', 5))
+
+# One model load at a time per process; reload_status is reported by /api/models
+reload_lock = threading.Lock()
+reload_status = {'loading': None, 'last_error': None, 'last_reload': None}
+
+# Maximum number of images accepted by /api/classify_batch
+MAX_BATCH_SIZE = 256
+
+# Maximum upload size of /api/classify_video
+MAX_VIDEO_BYTES = int(os.environ.get('MAX_VIDEO_MB', 200)) * 1024 * 1024
+
+# Decode large JPEGs at 1/2-1/8 scale when the crop still covers 224x224 (REDUCED_DECODE=0 disables)
+REDUCED_DECODE = os.environ.get('REDUCED_DECODE', '1') == '1'
+
+# Result cache for repeated images (keyed by image bytes + bbox + model version)
+result_cache = ResultCache(
+    max_entries=int(os.environ.get('RESULT_CACHE_SIZE', 1024)),
+    ttl_seconds=float(os.environ.get('RESULT_CACHE_TTL', 3600)),
+    disk_dir=os.environ.get('RESULT_CACHE_DIR')
+)
+
+def batched_predict_proba(features):
+    """predict_proba with the currently served model (the scheduler's default)"""
+    return serving.model.predict_proba(features)
+
+# Micro-batching of concurrent /api/classify requests (enable with INFERENCE_BATCHING=1)
+inference_scheduler = None
+if os.environ.get('INFERENCE_BATCHING', '0') == '1':
+    inference_scheduler = MicroBatchScheduler(
+        batched_predict_proba,
+        max_batch_size=int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 32)),
+        max_wait_ms=float(os.environ.get('INFERENCE_MAX_WAIT_MS', 5))
+    )
+
+# Prometheus metrics (served at /api/metrics)
+STAGE_SECONDS = Histogram(
+    'classify_stage_seconds', 'Latency of each stage of /api/classify', ['stage']
+)
+REQUEST_SECONDS = Histogram(
+    'api_request_seconds', 'End-to-end API request latency', ['endpoint']
+)
+REQUESTS_TOTAL = Counter(
+    'api_requests_total', 'API requests by endpoint and HTTP status', ['endpoint', 'status']
+)
+IN_FLIGHT = Gauge('api_requests_in_flight', 'API requests currently being handled')
+IMAGE_BYTES = Histogram(
+    'classify_image_bytes', 'Size of uploaded encoded images in bytes',
+    buckets=(16e3, 64e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6)
+)
+IMAGE_MEGAPIXELS = Histogram(
+    'classify_image_megapixels', 'Resolution of decoded images in megapixels',
+    buckets=(0.05, 0.25, 0.5, 1, 2, 4, 8, 12, 24, 48)
+)
+MODEL_LOAD_SECONDS = Gauge('model_load_seconds', 'Time taken by the last model load')
+MODEL_RELOADS = Counter('model_reloads_total', 'Model reloads by outcome', ['outcome'])
+CASCADE_EXITS = Counter(
+    'cascade_answers_total', 'Images answered by each cascade stage', ['stage']
+)
+
+def file_digest(path):
+    """Short content hash of a file, used as the model version"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+class ServingModel:
+    """One loaded model version with everything a request needs from it
+    
+    Requests take a reference to the current ServingModel once and use it
+    throughout, so a reload that swaps in a new one never changes the
+    model, metadata or feature profile under an in-flight request.
+    version is the name shown to clients and used by the registry (a
+    registry label such as "v3", or the content hash); content_version is
+    always the content hash of the loaded model files and keys the result
+    cache, so a reused label can never return another model's results.
+    """
+    
+    def __init__(self, model, metadata, version, description, load_seconds,
+                 cascade_model=None, cascade_threshold=None, content_version=None):
+        self.model = model
+        self.metadata = metadata
+        self.version = version
+        self.content_version = content_version or version
+        self.description = description
+        self.load_seconds = load_seconds
+        self.feature_profile = metadata.get('feature_profile', DEFAULT_PROFILE)
+        self.cascade_model = cascade_model
+        self.cascade_threshold = cascade_threshold
+
+def load_serving_model(model_path=DEFAULT_MODEL_PATH, version=None):
+    """Load a model, its metadata and cascade first stage without serving it
+    
+    Prefers the memory-mapped artifact ({model_path}.mmap/) when it is at
+    least as new as the joblib file, so forked or separately started
+    worker processes share one page-cached copy of the model arrays. The
+    version defaults to the content hash of the loaded files. Raises
+    ValueError if the model is missing or incompatible with this server.
+    """
+    model_file = Path(f"{model_path}.joblib")
+    mmap_path = artifact_path(model_path)
+    use_mmap = (mmap_path / MANIFEST_FILE).exists() and (
+        not model_file.exists()
+        or (mmap_path / MANIFEST_FILE).stat().st_mtime >= model_file.stat().st_mtime
+    )
+    
+    start = time.perf_counter()
+    rss_before = current_rss_mb()
+    if use_mmap:
+        model, manifest = load_artifact(mmap_path)
+        content_version = manifest['content_hash']
+        shared_mb = mapped_bytes(mmap_path) / (1024 * 1024)
+    elif model_file.exists():
+        model = joblib.load(model_file)
+        content_version = file_digest(model_file)
+        shared_mb = 0.0
+    else:
+        raise ValueError(f"Model file not found: {model_file}")
+    description = f"{'mmap artifact' if use_mmap else 'joblib'} {mmap_path if use_mmap else model_file}"
+    
+    # One vectorized pass over flat node arrays instead of sklearn's per-tree dispatch
+    if COMPILED_FOREST and is_forest(model):
+        model = compile_model(model)
+        description += " (compiled forest)"
+    load_seconds = time.perf_counter() - start
+    
+    logger.info(
+        f"Model loaded (version {version or content_version}, {description}) in "
+        f"{load_seconds * 1000:.1f} ms; RSS {current_rss_mb() - rss_before:+.1f} MB, "
+        f"{shared_mb:.1f} MB memory-mapped (shared)"
+    )
+    
+    # Load metadata
+    metadata_path = Path(f"{model_path}_metadata.json")
+    if not metadata_path.exists():
+        raise ValueError(f"Metadata file not found: {metadata_path}")
+    with open(metadata_path, 'r') as f:
+        metadata = json.load(f)
+    
+    # Refuse models trained against a different feature extractor
+    if not is_compatible(metadata):
+        raise ValueError(
+            f"Model feature extractor version "
+            f"{metadata.get('feature_extractor_version')} does not match "
+            f"server version {FEATURE_EXTRACTOR_VERSION}"
+        )
+    
+    # Extract only the feature stages the model was trained on
+    profile = metadata.get('feature_profile', DEFAULT_PROFILE)
+    if profile not in FEATURE_PROFILES:
+        raise ValueError(f"Unknown feature profile in model metadata: {profile}")
+    logger.info(f"Feature profile: {profile}")
+    
+    # Optional cheap first stage that answers confident images early
+    cascade_model, cascade_threshold = None, None
+    cascade = metadata.get('cascade')
+    if cascade and CASCADE_ENABLED:
+        cascade_model, _ = load_model_file(cascade_model_path(model_path), compiled=COMPILED_FOREST)
+        if cascade_model is None:
+            logger.warning("Cascade first-stage model not found; using the full model only")
+        else:
+            cascade_threshold = cascade['threshold']
+            logger.info(
+                f"Cascade enabled (threshold {cascade_threshold:.3f}, "
+                f"{cascade['early_exit_fraction']:.0%} early exits on validation data)"
+            )
+    
+    return ServingModel(
+        model, metadata, version or content_version, description, load_seconds,
+        cascade_model, cascade_threshold, content_version
+    )
+
+def warm_up(candidate):
+    """Run a test inference through every stage of a loaded model
+    
+    Fails (raises) before the model is swapped in if it cannot handle the
+    features this server extracts, and touches its pages so the first
+    real request does not pay for them.
+    """
+    image = np.full((IMAGE_SIZE, IMAGE_SIZE, 3), 128, dtype=np.uint8)
+    cv2.rectangle(image, (48, 48), (176, 176), (60, 90, 40), -1)
+    features = extract_features(image, profile=candidate.feature_profile).reshape(1, -1)
+    probabilities = candidate.model.predict_proba(features)
+    if probabilities.shape != (1, len(candidate.model.classes_)):
+        raise ValueError(f"Unexpected predict_proba output shape {probabilities.shape}")
+    if candidate.cascade_model is not None:
+        candidate.cascade_model.predict_proba(extract_features(image, profile=CASCADE_PROFILE).reshape(1, -1))
+
+def swap_model(candidate):
+    """Atomically make candidate the served model
+    
+    Requests that already took a reference to the previous model finish
+    on it; the old model is freed when the last of them completes.
+    """
+    global serving
+    previous = serving
+    serving = candidate
+    registry_watcher.seen = candidate.version
+    MODEL_LOAD_SECONDS.set(candidate.load_seconds)
+    # Cached results belong to the previous model
+    result_cache.clear()
+    logger.info(
+        f"Serving model version {candidate.version}"
+        + (f" (was {previous.version})" if previous is not None else "")
+    )
+
+def reload_model(version, activate=None, wait=False):
+    """Load, warm up and swap in a registry version; returns an error message or None
+    
+    activate is called after a successful warm-up and before the swap
+    (used to move the registry pointer only once the version is known to
+    work). Runs in the caller's thread; only one reload runs at a time.
+    With wait=True a reload that is already running is waited for instead
+    of reported as an error, and the version is not loaded again if that
+    reload already made it the served one.
+    """
+    if not reload_lock.acquire(blocking=wait):
+        return f"Model version {reload_status['loading']} is still loading"
+    try:
+        current = serving
+        if wait and activate is None and current is not None and current.version == version:
+            return None
+        reload_status['loading'] = version
+        candidate = load_serving_model(model_registry.model_path(version), version)
+        warm_up(candidate)
+        if activate is not None:
+            activate()
+        swap_model(candidate)
+        MODEL_RELOADS.inc(outcome='success')
+        reload_status.update(last_error=None, last_reload=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        return None
+    except Exception as e:
+        logger.error(f"Failed to load model version {version}: {e}")
+        MODEL_RELOADS.inc(outcome='failure')
+        reload_status['last_error'] = f"{version}: {e}"
+        return reload_status['last_error']
+    finally:
+        reload_status['loading'] = None
+        reload_lock.release()
+
+def follow_active_version(version):
+    """Registry watcher callback: load the newly active version once any running reload is done"""
+    reload_model(version, wait=True)
+
+# Follows the registry's active version (activated by another worker or the CLI)
+registry_watcher = RegistryWatcher(model_registry, follow_active_version, MODEL_RELOAD_INTERVAL)
 
 def load_model():
-    """Load the trained model and metadata"""
-    global model, metadata
+    """Load the registry's active version, or the default model files
     
+    Called once at startup; later versions are swapped in by
+    reload_model without a restart.
+    """
+    version = model_registry.active_version()
     try:
-        # Load model
-        model_path = "cattle_buffalo_model.joblib"
-        if Path(model_path).exists():
-            model = joblib.load(model_path)
-            logger.info("Model loaded successfully")
+        if version is not None:
+            candidate = load_serving_model(model_registry.model_path(version), version)
         else:
-            logger.error(f"Model file not found: {model_path}")
-            return False
-        
-        # Load metadata
-        metadata_path = "cattle_buffalo_model_metadata.json"
-        if Path(metadata_path).exists():
-            with open(metadata_path, 'r') as f:
-                metadata = json.load(f)
-            logger.info("Metadata loaded successfully")
-        else:
-            logger.error(f"Metadata file not found: {metadata_path}")
-            return False
-        
-        return True
+            candidate = load_serving_model(DEFAULT_MODEL_PATH)
+        warm_up(candidate)
     except Exception as e:
         logger.error(f"Error loading model: {e}")
         return False
+    
+    swap_model(candidate)
+    return True
+
+def to_rgb(image_array):
+    """Convert a decoded BGR (or grayscale) image to RGB"""
+    if image_array.ndim == 2:
+        return cv2.cvtColor(image_array, cv2.COLOR_GRAY2RGB)
+    return cv2.cvtColor(image_array, cv2.COLOR_BGR2RGB)
 
-def extract_features_from_image(image_array, bbox=None):
-    """Extract features from image array (same as training)"""
+def extract_features_from_image(image, bbox=None, profile=DEFAULT_PROFILE, stage_prefix=''):
+    """Extract features from a decoded RGB image array (same as training)"""
     try:
-        # Convert to RGB if needed
-        if len(image_array.shape) == 3 and image_array.shape[2] == 3:
-            image = image_array
-        else:
-            image = cv2.cvtColor(image_array, cv2.COLOR_BGR2RGB)
-        
-        # Crop to bounding box if provided
-        if bbox is not None:
-            xmin, ymin, xmax, ymax = bbox
-            image = image[ymin:ymax, xmin:xmax]
-        
-        # Resize image to standard size
-        image = cv2.resize(image, (224, 224))
-        
-        # Extract features (same as training script)
-        features = []
-        
-        # 1. Color histogram features
-        for i in range(3):  # RGB channels
-            hist = cv2.calcHist([image], [i], None, [32], [0, 256])
-            features.extend(hist.flatten())
-        
-        # 2. HSV color features
-        hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
-        for i in range(3):  # HSV channels
-            hist = cv2.calcHist([hsv], [i], None, [32], [0, 256])
-            features.extend(hist.flatten())
-        
-        # 3. Texture features (LBP-like)
-        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-        
-        # Local Binary Pattern approximation
-        lbp = compute_lbp(gray)
-        lbp_hist = cv2.calcHist([lbp], [0], None, [16], [0, 16])
-        features.extend(lbp_hist.flatten())
-        
-        # 4. Edge features
-        edges = cv2.Canny(gray, 50, 150)
-        edge_density = np.sum(edges > 0) / (edges.shape[0] * edges.shape[1])
-        features.append(edge_density)
+        timings = {}
+        features = extract_features(image, bbox, timings, profile)
         
-        # 5. Brightness and contrast
-        brightness = np.mean(gray)
-        contrast = np.std(gray)
-        features.extend([brightness, contrast])
-        
-        # 6. Shape features
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        if contours:
-            largest_contour = max(contours, key=cv2.contourArea)
-            area = cv2.contourArea(largest_contour)
-            perimeter = cv2.arcLength(largest_contour, True)
-            if perimeter > 0:
-                circularity = 4 * np.pi * area / (perimeter * perimeter)
-            else:
-                circularity = 0
-        else:
-            area = 0
-            circularity = 0
-        
-        features.extend([area, circularity])
-        
-        # 7. Color moments
-        for channel in range(3):
-            channel_data = image[:, :, channel].flatten()
-            mean = np.mean(channel_data)
-            std = np.std(channel_data)
-            skewness = compute_skewness(channel_data)
-            features.extend([mean, std, skewness])
-        
-        return np.array(features)
+        for stage, seconds in timings.items():
+            STAGE_SECONDS.observe(seconds, stage=stage_prefix + stage)
+        return features
         
     except Exception as e:
         logger.error(f"Error extracting features: {e}")
         return None
 
-def compute_lbp(image, radius=1, n_points=8):
-    """Compute Local Binary Pattern"""
-    rows, cols = image.shape
-    lbp = np.zeros_like(image)
+def classify_first_stage(current, image, bbox=None):
+    """Cascade first stage on an RGB image: the result if confident enough, else None"""
+    features = extract_features_from_image(image, bbox, CASCADE_PROFILE, stage_prefix='cascade_')
+    if features is None:
+        return None
+    with STAGE_SECONDS.time(stage='cascade_model'):
+        probabilities = current.cascade_model.predict_proba(features.reshape(1, -1))[0]
+    if probabilities.max() < current.cascade_threshold:
+        return None
+    class_names = current.cascade_model.classes_
+    return format_result(class_names[np.argmax(probabilities)], probabilities, class_names, current.metadata)
+
+def decode_image_bytes(buffer, bbox=None):
+    """Decode encoded image bytes (any buffer-protocol object) to a BGR array
     
-    for i in range(radius, rows - radius):
-        for j in range(radius, cols - radius):
-            center = image[i, j]
-            binary_string = ''
-            
-            for k in range(n_points):
-                angle = 2 * np.pi * k / n_points
-                x = int(i + radius * np.cos(angle))
-                y = int(j + radius * np.sin(angle))
-                
-                if x < rows and y < cols:
-                    if image[x, y] >= center:
-                        binary_string += '1'
-                    else:
-                        binary_string += '0'
-                else:
-                    binary_string += '0'
-            
-            lbp[i, j] = int(binary_string, 2)
+    Large JPEGs are decoded at a reduced scale when the crop still covers
+    the feature input size. Returns (image, bbox rescaled to the decoded
+    image, megapixels of the original image); image is None on failure.
+    """
+    image, bbox, _, megapixels = decode_image(buffer, bbox, reduced=REDUCED_DECODE)
+    return image, bbox, megapixels
+
+def decode_base64(image_data):
+    """Decode a base64 (optionally data URL) image string to bytes"""
+    if image_data.startswith('data:image'):
+        image_data = image_data.split(',')[1]
+    
+    return base64.b64decode(image_data)
+
+def parse_bbox(value):
+    """Parse a bbox given as "xmin,ymin,xmax,ymax" or a JSON list"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        value = value.strip().strip('[]')
+        value = [v for v in value.split(',') if v.strip()]
+    bbox = [int(float(v)) for v in value]
+    if len(bbox) != 4:
+        raise ValueError('bbox must have 4 values: xmin, ymin, xmax, ymax')
+    return bbox
+
+def read_upload_buffer(upload):
+    """Return the bytes of a multipart upload without an extra copy if possible"""
+    stream = upload.stream
+    if isinstance(stream, io.BytesIO):
+        # Small uploads are spooled in memory; expose the buffer directly
+        return stream.getbuffer()
+    return stream.read()
+
+def read_classify_request():
+    """Read the encoded image bytes and bbox from a JSON, multipart or raw binary request
     
-    return lbp
+    Returns (image_bytes, bbox, error) where error is a (message, status) tuple.
+    """
+    mimetype = request.mimetype
+    
+    if mimetype == 'multipart/form-data':
+        # Form upload: image file in the 'image' field, bbox as form or query field
+        upload = request.files.get('image')
+        if upload is None:
+            return None, None, ('No image data provided', 400)
+        bbox = parse_bbox(request.form.get('bbox', request.args.get('bbox')))
+        image_bytes = read_upload_buffer(upload)
+    
+    elif mimetype == 'application/octet-stream' or mimetype.startswith('image/'):
+        # Raw body: decode straight from the request buffer, bbox in the query
+        image_bytes = request.get_data(cache=False)
+        bbox = parse_bbox(request.args.get('bbox'))
+    
+    else:
+        # JSON with a base64 encoded image (original API)
+        data = request.get_json()
+        if not data or 'image' not in data:
+            return None, None, ('No image data provided', 400)
+        bbox = data.get('bbox')
+        image_bytes = decode_base64(data['image'])
+    
+    if not len(image_bytes):
+        return None, None, ('No image data provided', 400)
+    
+    return image_bytes, bbox, None
 
-def compute_skewness(data):
-    """Compute skewness of data"""
-    mean = np.mean(data)
-    std = np.std(data)
-    if std == 0:
-        return 0
-    return np.mean(((data - mean) / std) ** 3)
+def format_result(prediction, probabilities, class_names, metadata):
+    """Build the classification response for one image"""
+    probabilities_dict = {class_name: float(prob) for class_name, prob in zip(class_names, probabilities)}
+    
+    # Determine breed (simplified)
+    breed = "Unknown"
+    breed_confidence = 0.0
+    
+    if prediction == "Cattle":
+        # Simple breed detection based on probabilities
+        if probabilities_dict.get("Cattle", 0) > 0.8:
+            breed = "Holstein"  # Default cattle breed
+            breed_confidence = 0.7
+    elif prediction == "Buffalo":
+        if probabilities_dict.get("Buffalo", 0) > 0.8:
+            breed = "Asian buffalo"  # Default buffalo breed
+            breed_confidence = 0.7
+    
+    return {
+        'prediction': prediction,
+        'confidence': float(max(probabilities)),
+        'probabilities': probabilities_dict,
+        'breed': breed,
+        'breedConfidence': breed_confidence,
+        'model_type': metadata.get('model_type', 'Unknown'),
+        'class_mapping': metadata.get('class_mapping', {})
+    }
 
 @app.route('/api/classify', methods=['POST'])
 def classify_image():
-    """Classify an image as cattle or buffalo"""
+    """Classify an image as cattle or buffalo
+    
+    The image can be sent as JSON ({"image": <base64>, "bbox": [...]}), as a
+    multipart/form-data upload (file field 'image') or as a raw
+    application/octet-stream / image/* body. For the binary forms the bbox
+    is passed as "xmin,ymin,xmax,ymax" in the 'bbox' form or query field.
+    """
     try:
-        if model is None:
+        # The model this request runs on, even if a reload swaps in another meanwhile
+        current = serving
+        if current is None:
             return jsonify({'error': 'Model not loaded'}), 500
         
-        data = request.get_json()
-        if not data or 'image' not in data:
-            return jsonify({'error': 'No image data provided'}), 400
+        # Read image (JSON/base64, multipart or raw binary body)
+        try:
+            with STAGE_SECONDS.time(stage='read_request'):
+                image_bytes, bbox, error = read_classify_request()
+        except ValueError as e:
+            return jsonify({'error': f'Invalid request: {e}'}), 400
         
-        # Decode base64 image
-        image_data = data['image']
-        if image_data.startswith('data:image'):
-            image_data = image_data.split(',')[1]
+        if error is not None:
+            message, status = error
+            return jsonify({'error': message}), status
+        IMAGE_BYTES.observe(len(image_bytes))
         
-        image_bytes = base64.b64decode(image_data)
-        image_array = np.frombuffer(image_bytes, dtype=np.uint8)
-        image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+        # Return the cached result for a repeated image
+        with STAGE_SECONDS.time(stage='cache_lookup'):
+            cache_key = ResultCache.make_key(image_bytes, bbox, current.content_version)
+            result = result_cache.get(cache_key)
+        if result is not None:
+            logger.info(f"Classification result (cached): {result['prediction']}")
+            return jsonify(result)
         
+        with STAGE_SECONDS.time(stage='imdecode'):
+            image, bbox, megapixels = decode_image_bytes(image_bytes, bbox)
         if image is None:
             return jsonify({'error': 'Invalid image data'}), 400
+        IMAGE_MEGAPIXELS.observe(megapixels)
+        
+        # Convert to RGB, the channel order the model was trained on
+        with STAGE_SECONDS.time(stage='to_rgb'):
+            image = to_rgb(image)
+        
+        # Cascade: answer from colour histograms alone when the first stage is confident
+        if current.cascade_model is not None:
+            result = classify_first_stage(current, image, bbox)
+            if result is not None:
+                CASCADE_EXITS.inc(stage='1')
+                result_cache.put(cache_key, result)
+                logger.info(f"Classification result (cascade first stage): {result['prediction']}")
+                return jsonify(result)
+            CASCADE_EXITS.inc(stage='2')
         
         # Extract features
-        bbox = data.get('bbox')
-        features = extract_features_from_image(image, bbox)
+        features = extract_features_from_image(image, bbox, current.feature_profile)
         
         if features is None:
             return jsonify({'error': 'Failed to extract features'}), 500
         
         # Make prediction
-        features = features.reshape(1, -1)
-        prediction = model.predict(features)[0]
-        probabilities = model.predict_proba(features)[0]
+        model_start = time.perf_counter()
+        model = current.model
+        if inference_scheduler is not None:
+            # Batched with concurrent requests for the same model by the micro-batching scheduler
+            class_names = model.classes_
+            probabilities = inference_scheduler.predict_proba(features, predict_proba=model.predict_proba)
+            prediction = class_names[np.argmax(probabilities)]
+        else:
+            # Label and probabilities from one evaluation of the model
+            predictions, probabilities = predict_with_proba(model, features.reshape(1, -1))
+            prediction, probabilities = predictions[0], probabilities[0]
+            class_names = model.classes_
+        STAGE_SECONDS.observe(time.perf_counter() - model_start, stage='model')
         
-        # Get class names
-        class_names = model.classes_
-        probabilities_dict = {class_name: float(prob) for class_name, prob in zip(class_names, probabilities)}
+        result = format_result(prediction, probabilities, class_names, current.metadata)
+        result_cache.put(cache_key, result)
         
-        # Determine breed (simplified)
-        breed = "Unknown"
-        breed_confidence = 0.0
+        logger.info(f"Classification result: {prediction} (confidence: {result['confidence']:.3f})")
+        return jsonify(result)
         
-        if prediction == "Cattle":
-            # Simple breed detection based on probabilities
-            if probabilities_dict.get("Cattle", 0) > 0.8:
-                breed = "Holstein"  # Default cattle breed
-                breed_confidence = 0.7
-        elif prediction == "Buffalo":
-            if probabilities_dict.get("Buffalo", 0) > 0.8:
-                breed = "Asian buffalo"  # Default buffalo breed
-                breed_confidence = 0.7
+    except Exception as e:
+        logger.error(f"Error in classification: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/classify_batch', methods=['POST'])
+def classify_batch():
+    """Classify many images with a single vectorized model call
+    
+    Accepts {"images": [{"image": <base64>, "bbox": [...]}, ...]} (plain
+    base64 strings are also accepted as items). Results are returned in
+    request order; an image that fails to decode or extract gets an
+    'error' entry instead of failing the whole batch.
+    """
+    try:
+        current = serving
+        if current is None:
+            return jsonify({'error': 'Model not loaded'}), 500
         
-        result = {
-            'prediction': prediction,
-            'confidence': float(max(probabilities)),
-            'probabilities': probabilities_dict,
-            'breed': breed,
-            'breedConfidence': breed_confidence,
-            'model_type': metadata.get('model_type', 'Unknown'),
-            'class_mapping': metadata.get('class_mapping', {})
-        }
+        data = request.get_json()
+        items = data.get('images') if isinstance(data, dict) else None
+        if not items or not isinstance(items, list):
+            return jsonify({'error': 'No images provided'}), 400
         
-        logger.info(f"Classification result: {prediction} (confidence: {result['confidence']:.3f})")
+        if len(items) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'Batch too large (max {MAX_BATCH_SIZE} images)'}), 413
+        
+        results = [None] * len(items)
+        images = []
+        bboxes = []
+        positions = []
+        cache_keys = []
+        
+        # Decode every image, recording per-item failures
+        for i, item in enumerate(items):
+            if isinstance(item, str):
+                item = {'image': item}
+            try:
+                if not isinstance(item, dict) or 'image' not in item:
+                    results[i] = {'error': 'No image data provided'}
+                    continue
+                image_bytes = decode_base64(item['image'])
+                bbox = item.get('bbox')
+                cache_key = ResultCache.make_key(image_bytes, bbox, current.content_version)
+                cached = result_cache.get(cache_key)
+                if cached is not None:
+                    results[i] = cached
+                    continue
+                image, bbox, _ = decode_image_bytes(image_bytes, bbox)
+                if image is None:
+                    results[i] = {'error': 'Invalid image data'}
+                    continue
+                images.append(to_rgb(image))
+                bboxes.append(bbox)
+                positions.append(i)
+                cache_keys.append(cache_key)
+            except Exception as e:
+                results[i] = {'error': f'Invalid image data: {e}'}
+        
+        # Cascade: confident first-stage answers leave the batch before full extraction
+        if images and current.cascade_model is not None:
+            first_features = extract_features_batch(images, bboxes, profile=CASCADE_PROFILE)
+            confident = np.zeros(len(images), dtype=bool)
+            first_valid = ~np.isnan(first_features).any(axis=1)
+            if first_valid.any():
+                class_names = current.cascade_model.classes_
+                probabilities = current.cascade_model.predict_proba(first_features[first_valid])
+                confident[first_valid] = probabilities.max(axis=1) >= current.cascade_threshold
+                for j, row in zip(np.flatnonzero(first_valid), probabilities):
+                    if confident[j]:
+                        results[positions[j]] = format_result(
+                            class_names[np.argmax(row)], row, class_names, current.metadata
+                        )
+                        result_cache.put(cache_keys[j], results[positions[j]])
+            CASCADE_EXITS.inc(int(confident.sum()), stage='1')
+            CASCADE_EXITS.inc(int((~confident).sum()), stage='2')
+            keep = np.flatnonzero(~confident)
+            images = [images[j] for j in keep]
+            bboxes = [bboxes[j] for j in keep]
+            positions = [positions[j] for j in keep]
+            cache_keys = [cache_keys[j] for j in keep]
+        
+        # Extract features for the whole batch and predict in one call
+        if images:
+            features = extract_features_batch(images, bboxes, profile=current.feature_profile)
+            valid = ~np.isnan(features).any(axis=1)
+            
+            for i in np.asarray(positions)[~valid]:
+                results[i] = {'error': 'Failed to extract features'}
+            
+            if valid.any():
+                class_names = current.model.classes_
+                probabilities = current.model.predict_proba(features[valid])
+                predictions = class_names[np.argmax(probabilities, axis=1)]
+                
+                for i, cache_key, prediction, row in zip(
+                        np.asarray(positions)[valid], np.asarray(cache_keys)[valid],
+                        predictions, probabilities):
+                    results[i] = format_result(prediction, row, class_names, current.metadata)
+                    result_cache.put(cache_key, results[i])
+        
+        n_errors = sum(1 for result in results if 'error' in result)
+        logger.info(f"Batch classification: {len(items)} images, {n_errors} errors")
+        return jsonify({
+            'results': results,
+            'count': len(results),
+            'errors': n_errors
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in batch classification: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/classify_video', methods=['POST'])
+def classify_video_upload():
+    """Classify sampled frames of an uploaded video clip
+    
+    The clip is sent as a multipart 'video' field or as the raw request
+    body and is streamed to a temporary file (at most MAX_VIDEO_MB).
+    Optional query/form fields: stride (classify every n-th frame),
+    batch_size (at most video.MAX_BATCH_SIZE), smoothing (EMA weight of
+    the newest frame) and bbox.
+    """
+    try:
+        current = serving
+        if current is None:
+            return jsonify({'error': 'Model not loaded'}), 500
+        
+        options = request.form if request.mimetype == 'multipart/form-data' else request.args
+        try:
+            stride = max(int(options.get('stride', 5)), 1)
+            batch_size = max(int(options.get('batch_size', 32)), 1)
+            alpha = min(max(float(options.get('smoothing', 0.3)), 0.0), 1.0)
+            bbox = parse_bbox(options.get('bbox'))
+        except ValueError as e:
+            return jsonify({'error': f'Invalid request: {e}'}), 400
+        
+        if request.mimetype == 'multipart/form-data':
+            upload = request.files.get('video')
+            if upload is None:
+                return jsonify({'error': 'No video provided'}), 400
+            suffix = Path(upload.filename or '').suffix or '.mp4'
+        else:
+            upload = None
+            suffix = '.mp4'
+        
+        # OpenCV reads videos from a path, so spool the upload to a temporary
+        # file. It is closed before OpenCV opens it by name (an open temporary
+        # file can't be opened a second time on Windows) and removed afterwards.
+        fd, video_path = tempfile.mkstemp(suffix=suffix)
+        try:
+            with os.fdopen(fd, 'wb') as video_file:
+                if upload is not None:
+                    upload.save(video_file)
+                else:
+                    shutil.copyfileobj(request.stream, video_file)
+                size = video_file.tell()
+            if size == 0:
+                return jsonify({'error': 'No video provided'}), 400
+            
+            try:
+                result = classify_video(
+                    current.model, video_path, stride=stride, batch_size=batch_size, alpha=alpha,
+                    bbox=bbox, profile=current.feature_profile
+                )
+            except ValueError:
+                return jsonify({'error': 'Invalid or unsupported video'}), 400
+        finally:
+            os.unlink(video_path)
+        
+        if result['prediction'] is None:
+            return jsonify({'error': 'No frames could be classified', **result}), 400
+        
+        logger.info(
+            f"Video classification: {result['prediction']} over {result['frames_classified']} frames "
+            f"({result['classified_fps']:.1f} fps classified, {result['realtime_factor']:.1f}x real time)"
+        )
         return jsonify(result)
         
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'Video too large (max {MAX_VIDEO_BYTES // (1024 * 1024)} MB)'}), 413
     except Exception as e:
-        logger.error(f"Error in classification: {e}")
+        logger.error(f"Error in video classification: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.before_request
+def follow_registry():
+    """Start this process's registry watcher (worker processes are forked after startup)"""
+    registry_watcher.ensure_started()
+
+@app.before_request
+def start_request_metrics():
+    """Track in-flight API requests"""
+    if request.path.startswith('/api/') and request.endpoint != 'metrics':
+        g.request_start = time.perf_counter()
+        IN_FLIGHT.inc()
+
+@app.after_request
+def record_request_metrics(response):
+    """Count API requests by status and record their latency"""
+    if 'request_start' in g:
+        endpoint = request.endpoint or 'unknown'
+        REQUESTS_TOTAL.inc(endpoint=endpoint, status=response.status_code)
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if g.pop('request_start', None) is not None:
+        IN_FLIGHT.dec()
+
+def collect_component_metrics():
+    """Expose the result cache and micro-batching scheduler counters"""
+    cache = result_cache.stats()
+    lines = [
+        '# HELP result_cache_hits_total Result cache hits',
+        '# TYPE result_cache_hits_total counter',
+        f"result_cache_hits_total {cache['hits']}",
+        '# HELP result_cache_misses_total Result cache misses',
+        '# TYPE result_cache_misses_total counter',
+        f"result_cache_misses_total {cache['misses']}",
+        '# HELP result_cache_entries Entries in the result cache',
+        '# TYPE result_cache_entries gauge',
+        f"result_cache_entries {cache['entries']}"
+    ]
+    
+    if inference_scheduler is not None:
+        counts = inference_scheduler.histogram_counts()
+        lines += [
+            '# HELP inference_batch_size Rows per batched predict_proba call',
+            '# TYPE inference_batch_size histogram'
+        ]
+        lines += format_histogram(
+            'inference_batch_size', BATCH_SIZE_BUCKETS, counts['batch_size'], counts['requests']
+        )
+        lines += [
+            '# HELP inference_queue_wait_seconds Time a request waited in the batching queue',
+            '# TYPE inference_queue_wait_seconds histogram'
+        ]
+        lines += format_histogram(
+            'inference_queue_wait_seconds', [b / 1000 for b in QUEUE_WAIT_BUCKETS_MS],
+            counts['queue_wait'], counts['queue_wait_sum_ms'] / 1000
+        )
+    return lines
+
+REGISTRY.add_collector(collect_component_metrics)
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics for this process"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+def start_reload(version, activate, wait):
+    """Reload in the background (202) or, with wait, in this request (200 or 500)"""
+    if wait:
+        error = reload_model(version, activate)
+        if error is not None:
+            return jsonify({'error': error}), 500
+        return jsonify({'serving': version, 'state': model_registry.state()})
+    
+    threading.Thread(
+        target=reload_model, args=(version, activate), name='model-reload', daemon=True
+    ).start()
+    return jsonify({'loading': version}), 202
+
+@app.route('/api/models', methods=['GET'])
+def list_models():
+    """Registry versions, the active version and the version this process serves"""
+    current = serving
+    state = model_registry.state()
+    return jsonify({
+        'registry': str(model_registry.root),
+        'active': state['active'],
+        'history': state['history'],
+        'serving': current.version if current is not None else None,
+        'serving_source': current.description if current is not None else None,
+        'versions': model_registry.versions(),
+        **reload_status
+    })
+
+@app.route('/api/models/activate', methods=['POST'])
+def activate_model():
+    """Load, warm up and swap in a registry version, then make it the active one
+    
+    Body: {"version": "v3", "wait": false}. The registry pointer only
+    moves once the version has loaded and passed a test inference here;
+    other worker processes follow it within MODEL_RELOAD_INTERVAL seconds.
+    Without wait the load runs in the background (202); poll /api/models.
+    """
+    data = request.get_json(silent=True) or {}
+    version = data.get('version')
+    if not version:
+        return jsonify({'error': 'No version provided'}), 400
+    if not model_registry.exists(version):
+        return jsonify({'error': f'Unknown model version {version!r}'}), 404
+    if reload_lock.locked():
+        return jsonify({'error': f"Model version {reload_status['loading']} is still loading"}), 409
+    
+    current = serving
+    if current is not None and current.version == version and model_registry.active_version() == version:
+        return jsonify({'serving': version, 'state': model_registry.state()})
+    return start_reload(version, lambda: model_registry.activate(version), bool(data.get('wait')))
+
+@app.route('/api/models/rollback', methods=['POST'])
+def rollback_model():
+    """Swap back to the previously active registry version (body: {"wait": false})"""
+    data = request.get_json(silent=True) or {}
+    try:
+        version = model_registry.rollback_target()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if reload_lock.locked():
+        return jsonify({'error': f"Model version {reload_status['loading']} is still loading"}), 409
+    return start_reload(version, model_registry.rollback, bool(data.get('wait')))
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
-        'model_loaded': model is not None,
-        'metadata_loaded': metadata is not None
+        'model_loaded': serving is not None,
+        'metadata_loaded': serving is not None,
+        'model_version': serving.version if serving is not None else None
     })
 
+@app.route('/api/cache_stats', methods=['GET'])
+def cache_stats():
+    """Result cache hit/miss counters"""
+    stats = result_cache.stats()
+    stats['model_version'] = serving.version if serving is not None else None
+    stats['model_content_version'] = serving.content_version if serving is not None else None
+    return jsonify(stats)
+
+@app.route('/api/scheduler_stats', methods=['GET'])
+def scheduler_stats():
+    """Micro-batching scheduler metrics (batch sizes and queue wait)"""
+    if inference_scheduler is None:
+        return jsonify({'enabled': False})
+    
+    stats = inference_scheduler.stats()
+    stats['enabled'] = True
+    return jsonify(stats)
+
 @app.route('/api/model_info', methods=['GET'])
 def model_info():
     """Get model information"""
-    if metadata is None:
+    current = serving
+    if current is None:
         return jsonify({'error': 'Metadata not loaded'}), 500
     
-    return jsonify(metadata)
+    return jsonify(current.metadata)
 
 if __name__ == '__main__':
     # Load model on startup
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Offline Benchmark Suite for Cattle vs Buffalo Classification
+Times every feature stage, full extract_features and single vs batched
+inference on synthetic images, and measures the memory allocated per
+extraction, without a running server
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import cv2
+import numpy as np
+
+from features import (
+    extract_features, extract_features_batch, profile_columns, Workspace, N_FEATURES, DEFAULT_PROFILE
+)
+from image_decode import decode_image
+from model_artifact import load_model_file, load_metadata, compile_model, is_forest, predict_with_proba
+
+# Same switch as the API, so the imdecode stage matches serving
+REDUCED_DECODE = os.environ.get('REDUCED_DECODE', '1') == '1'
+
+# Image resolutions (width, height) and bbox sizes (fraction of each side, None = whole image)
+RESOLUTIONS = ((320, 240), (640, 480), (1280, 720), (1920, 1080))
+BBOX_FRACTIONS = (None, 0.5, 0.25)
+BATCH_SIZES = (1, 8, 32, 128)
+
+# Order the stages are reported in
+STAGES = (
+    "imdecode", "crop_resize", "color_convert", "lbp", "edges_shape", "statistics"
+)
+
+
+def create_test_image(width, height, seed=0):
+    """Synthetic RGB image: light noisy background with a dark animal-like shape"""
+    rng = np.random.default_rng(seed)
+    img = rng.integers(200, 256, size=(height, width, 3), dtype=np.uint8)
+
+    # Dark body plus a head, with some texture so LBP and edges have work to do
+    center = (width // 2, height // 2)
+    axes = (width // 4, height // 5)
+    cv2.ellipse(img, center, axes, 0, 0, 360, (60, 55, 50), -1)
+    cv2.circle(img, (center[0] + axes[0], center[1] - axes[1] // 2), max(axes[1] // 2, 1), (40, 40, 40), -1)
+    noise = rng.integers(0, 30, size=img.shape, dtype=np.uint8)
+    return cv2.add(img, noise)
+
+
+def centered_bbox(width, height, fraction):
+    """Bounding box covering the given fraction of each side, centered"""
+    if fraction is None:
+        return None
+    box_w, box_h = int(width * fraction), int(height * fraction)
+    xmin, ymin = (width - box_w) // 2, (height - box_h) // 2
+    return [xmin, ymin, xmin + box_w, ymin + box_h]
+
+
+def summarize(samples):
+    """Median/p90/min of a list of durations in seconds, reported in ms"""
+    ms = np.asarray(samples) * 1000
+    return {
+        "median_ms": round(float(np.median(ms)), 4),
+        "p90_ms": round(float(np.percentile(ms, 90)), 4),
+        "min_ms": round(float(np.min(ms)), 4),
+        "repeats": len(ms)
+    }
+
+
+def load_benchmark_model(model_path):
+    """Load the trained model the way app.py does, or fit a synthetic stand-in
+
+    Returns (model, description, feature profile). Forests are returned
+    uncompiled so bench_inference can time sklearn and the compiled
+    evaluator side by side. The stand-in is a fixed-seed random forest on
+    random features, so inference timings stay comparable between
+    machines without the dataset.
+    """
+    model, description = load_model_file(model_path, compiled=False)
+    if model is not None:
+        return model, description, load_metadata(model_path).get('feature_profile', DEFAULT_PROFILE)
+
+    from sklearn.ensemble import RandomForestClassifier
+    rng = np.random.default_rng(0)
+    X = rng.random((400, N_FEATURES), dtype=np.float32)
+    y = (X[:, :10].sum(axis=1) > 5).astype(int)
+    model = RandomForestClassifier(n_estimators=100, max_depth=20, random_state=42).fit(X, y)
+    return model, "synthetic RandomForestClassifier (no trained model found)", DEFAULT_PROFILE
+
+
+def bench_features(repeats, warmup):
+    """Per-stage and end-to-end feature extraction timings per image case"""
+    results = {}
+    for width, height in RESOLUTIONS:
+        image = create_test_image(width, height)
+        _, encoded = cv2.imencode(".jpg", cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+        encoded = encoded.tobytes()
+
+        for fraction in BBOX_FRACTIONS:
+            bbox = centered_bbox(width, height, fraction)
+            case = f"{width}x{height}/bbox_{'full' if fraction is None else int(fraction * 100)}"
+            stage_samples = {stage: [] for stage in STAGES}
+            total_samples = []
+
+            for i in range(warmup + repeats):
+                timings = {}
+                start = time.perf_counter()
+                # Decode exactly as the API does for uploaded bytes
+                decoded, decoded_bbox, _, _ = decode_image(encoded, bbox, reduced=REDUCED_DECODE)
+                decoded = cv2.cvtColor(decoded, cv2.COLOR_BGR2RGB)
+                timings["imdecode"] = time.perf_counter() - start
+                extract_features(decoded, decoded_bbox, timings=timings)
+                elapsed = time.perf_counter() - start
+                if i < warmup:
+                    continue
+                total_samples.append(elapsed)
+                for stage in STAGES:
+                    stage_samples[stage].append(timings.get(stage, 0.0))
+
+            for stage in STAGES:
+                results[f"stage/{case}/{stage}"] = summarize(stage_samples[stage])
+            results[f"extract_features/{case}"] = summarize(total_samples)
+            print(f"  {case:<22} {results[f'extract_features/{case}']['median_ms']:8.2f} ms")
+    return results
+
+
+def bench_batched_features(repeats, warmup):
+    """Per-image cost of extract_features_batch at each batch size"""
+    results = {}
+    image = create_test_image(640, 480)
+    bbox = centered_bbox(640, 480, 0.5)
+    for batch_size in BATCH_SIZES:
+        images = [image] * batch_size
+        bboxes = [bbox] * batch_size
+        samples = []
+        for i in range(warmup + repeats):
+            start = time.perf_counter()
+            extract_features_batch(images, bboxes)
+            if i >= warmup:
+                samples.append((time.perf_counter() - start) / batch_size)
+        results[f"extract_features_batch/{batch_size}/per_image"] = summarize(samples)
+        print(f"  batch {batch_size:<4} {results[f'extract_features_batch/{batch_size}/per_image']['median_ms']:8.2f} ms/image")
+    return results
+
+
+def bench_allocations(repeats, warmup):
+    """Peak transient allocation and time per extraction, reusing vs rebuilding the workspace
+
+    "reused" is the steady state of a serving thread: the thread's
+    workspace and a preallocated output row. "fresh" builds a new
+    Workspace per call, which allocates every intermediate image like the
+    pre-workspace kernel. Peaks are measured with tracemalloc, which sees
+    NumPy arrays (including OpenCV outputs) but not OpenCV's internal
+    temporaries; timings are taken in separate runs without tracing.
+    """
+    results = {}
+    image = create_test_image(640, 480)
+    bbox = centered_bbox(640, 480, 0.5)
+    row = np.empty(len(profile_columns(DEFAULT_PROFILE)), dtype=np.float32)
+    images = [image] * 32
+    bboxes = [bbox] * 32
+    cases = {
+        "single/reused": lambda: extract_features(image, bbox, out=row),
+        "single/fresh": lambda: extract_features_batch([image], [bbox], workspace=Workspace()),
+        "batch_32/reused": lambda: extract_features_batch(images, bboxes),
+        "batch_32/fresh": lambda: extract_features_batch(images, bboxes, workspace=Workspace()),
+    }
+    for name, run in cases.items():
+        per_call = 32 if name.startswith("batch") else 1
+        samples = []
+        for i in range(warmup + repeats):
+            start = time.perf_counter()
+            run()
+            if i >= warmup:
+                samples.append((time.perf_counter() - start) / per_call)
+
+        peaks = []
+        tracemalloc.start()
+        try:
+            for _ in range(max(1, repeats // 4)):
+                before, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                run()
+                peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        finally:
+            tracemalloc.stop()
+
+        key = f"allocations/{name}/per_image"
+        results[key] = summarize(samples)
+        results[key]["peak_alloc_kb"] = round(min(peaks) / 1024 / per_call, 1)
+        print(f"  {name:<16} {results[key]['median_ms']:8.2f} ms/image"
+              f"   peak {results[key]['peak_alloc_kb']:10.1f} KB/image")
+    return results
+
+
+def bench_inference(model, profile, repeats, warmup):
+    """predict_proba latency one row at a time vs one call per batch
+
+    For sklearn forests the compiled flat-array evaluator the server uses
+    is timed as well (compiled_* entries: label and probabilities from one
+    predict_with_proba call, as in /api/classify).
+    """
+    results = {}
+    images = [create_test_image(320, 240, seed=i) for i in range(max(BATCH_SIZES))]
+    X = extract_features_batch(images, profile=profile)
+    compiled = compile_model(model) if is_forest(model) else None
+
+    for batch_size in BATCH_SIZES:
+        batch = X[:batch_size]
+        single, batched = [], []
+        for i in range(warmup + repeats):
+            start = time.perf_counter()
+            for row in range(batch_size):
+                model.predict_proba(batch[row:row + 1])
+            middle = time.perf_counter()
+            model.predict_proba(batch)
+            end = time.perf_counter()
+            if i >= warmup:
+                single.append((middle - start) / batch_size)
+                batched.append((end - middle) / batch_size)
+        results[f"inference/{batch_size}/single_per_row"] = summarize(single)
+        results[f"inference/{batch_size}/batched_per_row"] = summarize(batched)
+        print(f"  batch {batch_size:<4} single {results[f'inference/{batch_size}/single_per_row']['median_ms']:8.3f} ms/row"
+              f"   batched {results[f'inference/{batch_size}/batched_per_row']['median_ms']:8.3f} ms/row")
+
+        if compiled is None:
+            continue
+        single, batched = [], []
+        for i in range(warmup + repeats):
+            start = time.perf_counter()
+            for row in range(batch_size):
+                predict_with_proba(compiled, batch[row:row + 1])
+            middle = time.perf_counter()
+            predict_with_proba(compiled, batch)
+            end = time.perf_counter()
+            if i >= warmup:
+                single.append((middle - start) / batch_size)
+                batched.append((end - middle) / batch_size)
+        results[f"inference/{batch_size}/compiled_single_per_row"] = summarize(single)
+        results[f"inference/{batch_size}/compiled_batched_per_row"] = summarize(batched)
+        print(f"  {'compiled':<10} single {results[f'inference/{batch_size}/compiled_single_per_row']['median_ms']:8.3f} ms/row"
+              f"   batched {results[f'inference/{batch_size}/compiled_batched_per_row']['median_ms']:8.3f} ms/row")
+    return results
+
+
+def environment_info():
+    """Library versions and machine details stored with every run"""
+    import sklearn
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "sklearn": sklearn.__version__,
+        "opencv_threads": cv2.getNumThreads()
+    }
+
+
+def run_benchmarks(args):
+    """Run every benchmark group and return the result document"""
+    if args.native_threads:
+        from serve import limit_native_threads
+        limit_native_threads(args.native_threads)
+
+    model, model_description, profile = load_benchmark_model(args.model)
+    print(f"Model: {model_description}, feature profile {profile}")
+
+    results = {}
+    print("\nFeature extraction (median per image):")
+    results.update(bench_features(args.repeats, args.warmup))
+    print("\nBatched feature extraction:")
+    results.update(bench_batched_features(args.repeats, args.warmup))
+    print("\nAllocations per extraction:")
+    results.update(bench_allocations(args.repeats, args.warmup))
+    print("\nInference:")
+    results.update(bench_inference(model, profile, args.repeats, args.warmup))
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment_info(),
+        "config": {
+            "repeats": args.repeats,
+            "warmup": args.warmup,
+            "native_threads": args.native_threads,
+            "reduced_decode": REDUCED_DECODE,
+            "model": model_description,
+            "feature_profile": profile
+        },
+        "results": results
+    }
+
+
+def compare_results(baseline, current, threshold, min_delta_ms):
+    """Compare medians; returns the list of regressed benchmark names
+
+    A benchmark regresses when its median is more than threshold (a
+    fraction) slower than the baseline and the absolute slowdown exceeds
+    min_delta_ms, so sub-microsecond noise is not reported. Peak
+    allocations (peak_alloc_kb) regress by the same relative threshold.
+    """
+    regressions = []
+    print(f"\n{'Benchmark':<52} {'Baseline':>10} {'Current':>10} {'Change':>8}")
+    print("-" * 84)
+    for name in sorted(set(baseline["results"]) & set(current["results"])):
+        before = baseline["results"][name]["median_ms"]
+        after = current["results"][name]["median_ms"]
+        change = (after - before) / before if before > 0 else 0.0
+        regressed = change > threshold and after - before > min_delta_ms
+        marker = "  REGRESSION" if regressed else ""
+        print(f"{name:<52} {before:>8.3f}ms {after:>8.3f}ms {change:>+7.1%}{marker}")
+        if regressed:
+            regressions.append(name)
+
+        before_kb = baseline["results"][name].get("peak_alloc_kb")
+        after_kb = current["results"][name].get("peak_alloc_kb")
+        if before_kb is not None and after_kb is not None:
+            alloc_regressed = after_kb > before_kb * (1 + threshold) and after_kb - before_kb > 1
+            marker = "  REGRESSION" if alloc_regressed else ""
+            print(f"{'  peak allocation':<52} {before_kb:>8.1f}KB {after_kb:>8.1f}KB{marker}")
+            if alloc_regressed:
+                regressions.append(f"{name} (allocations)")
+
+    missing = sorted(set(baseline["results"]) - set(current["results"]))
+    if missing:
+        print(f"\nNot in current run: {', '.join(missing)}")
+    if baseline.get("environment") != current.get("environment"):
+        print("\nWarning: baseline was recorded in a different environment")
+    return regressions
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Offline benchmarks for feature extraction and inference")
+    parser.add_argument("--output", default=None,
+                        help="Write results as JSON to this file")
+    parser.add_argument("--baseline", default=None,
+                        help="Compare against a stored results file and exit 1 on regressions")
+    parser.add_argument("--current", default=None,
+                        help="Use an existing results file instead of running the benchmarks")
+    parser.add_argument("--model", default="cattle_buffalo_model",
+                        help="Model path prefix (.mmap/ or .joblib); a synthetic forest is used if missing")
+    parser.add_argument("--repeats", type=int, default=20, help="Timed runs per benchmark")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed runs before measuring")
+    parser.add_argument("--native-threads", type=int, default=1,
+                        help="OpenCV/BLAS threads (0 leaves the library defaults)")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative slowdown reported as a regression (default 0.10 = 10%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05,
+                        help="Ignore slowdowns smaller than this many milliseconds")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run (or load) the benchmarks, save them and optionally compare"""
+    args = parse_args(argv)
+
+    print("Cattle vs Buffalo Offline Benchmarks")
+    print("=" * 50)
+
+    if args.current:
+        with open(args.current, "r") as f:
+            current = json.load(f)
+    else:
+        current = run_benchmarks(args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare_results(baseline, current, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+            return 1
+        print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
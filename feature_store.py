@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Persistent Feature Store for Incremental Retraining
+Caches extracted feature rows on disk, keyed by image file hash + bbox +
+feature extractor version, so retraining only extracts new annotations
+"""
+
+from pathlib import Path
+import hashlib
+import json
+import os
+import sqlite3
+import numpy as np
+
+from features import FEATURE_EXTRACTOR_VERSION, N_FEATURES
+
+# Keys per "IN (...)" query; stays below SQLite's bound-parameter limit
+LOOKUP_BATCH = 500
+
+
+class FeatureStore:
+    """Directory of append-only .npy shards plus an SQLite index
+
+    Each call to add() writes one new shard and commits its keys in one
+    transaction, so adding rows never rewrites existing shards or index
+    entries. Row locations and file hashes are queried from the index on
+    demand rather than loaded into memory, so memory use does not grow
+    with the store. Shards are opened memory-mapped, so cached rows are
+    read from the page cache without deserializing the whole store.
+    Rows whose extraction failed are stored as NaN so they aren't retried.
+    """
+
+    INDEX_FILE = "index.sqlite"
+    # Index of stores written before the SQLite index; imported on first open
+    LEGACY_INDEX_FILE = "index.json"
+
+    def __init__(self, path, n_features=N_FEATURES, version=FEATURE_EXTRACTOR_VERSION):
+        self.path = Path(path)
+        self.n_features = n_features
+        self.version = version
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._shards = {}
+        self._open_index()
+
+    def _open_index(self):
+        index_path = self.path / self.INDEX_FILE
+        created = not index_path.exists()
+        self._db = sqlite3.connect(index_path)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS shards (number INTEGER PRIMARY KEY, name TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS rows (
+                key TEXT PRIMARY KEY, shard INTEGER NOT NULL, row INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT
+            ) WITHOUT ROWID;
+        """)
+        if created and (self.path / self.LEGACY_INDEX_FILE).exists():
+            self._import_legacy_index()
+
+        stored = self._db.execute("SELECT value FROM meta WHERE name = 'n_features'").fetchone()
+        if stored is None:
+            with self._db:
+                self._db.execute("INSERT INTO meta VALUES ('n_features', ?)", (str(self.n_features),))
+        elif int(stored[0]) != self.n_features:
+            raise ValueError(
+                f"Feature store {self.path} holds {stored[0]} features per row, "
+                f"expected {self.n_features}"
+            )
+
+    def _import_legacy_index(self):
+        """Copy a JSON index (shards, rows, files) into the SQLite index"""
+        with open(self.path / self.LEGACY_INDEX_FILE, 'r') as f:
+            index = json.load(f)
+        with self._db:
+            if 'n_features' in index:
+                self._db.execute("INSERT INTO meta VALUES ('n_features', ?)", (str(index['n_features']),))
+            self._db.executemany("INSERT INTO shards VALUES (?, ?)", enumerate(index.get('shards', [])))
+            self._db.executemany(
+                "INSERT INTO rows VALUES (?, ?, ?)",
+                ((key, number, row) for key, (number, row) in index.get('rows', {}).items())
+            )
+            self._db.executemany(
+                "INSERT INTO files VALUES (?, ?, ?, ?)",
+                ((path, *entry) for path, entry in index.get('files', {}).items())
+            )
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def __contains__(self, key):
+        return self._db.execute("SELECT 1 FROM rows WHERE key = ?", (key,)).fetchone() is not None
+
+    def file_hash(self, image_path):
+        """Content hash of an image file (re-hashed only if size/mtime change)"""
+        stat = os.stat(image_path)
+        cached = self._db.execute(
+            "SELECT size, mtime_ns, hash FROM files WHERE path = ?", (str(image_path),)
+        ).fetchone()
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        digest = hashlib.sha256()
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        file_hash = digest.hexdigest()
+        # Committed with the next add() or save()
+        self._db.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+            (str(image_path), stat.st_size, stat.st_mtime_ns, file_hash)
+        )
+        return file_hash
+
+    def make_key(self, image_path, bbox=None):
+        """Store key for one annotation"""
+        bbox = None if bbox is None else [int(v) for v in bbox]
+        return hashlib.sha256(
+            f"{self.file_hash(image_path)}|{bbox}|{self.version}".encode()
+        ).hexdigest()
+
+    def _shard(self, number):
+        if number not in self._shards:
+            name, = self._db.execute("SELECT name FROM shards WHERE number = ?", (number,)).fetchone()
+            self._shards[number] = np.load(self.path / name, mmap_mode='r')
+        return self._shards[number]
+
+    def _row(self, number, row):
+        features = self._shard(number)[row]
+        if np.isnan(features).any():
+            return None
+        return features
+
+    def get(self, key):
+        """Return the stored feature row (read-only view), None if failed, or raise KeyError"""
+        location = self._db.execute("SELECT shard, row FROM rows WHERE key = ?", (key,)).fetchone()
+        if location is None:
+            raise KeyError(key)
+        return self._row(*location)
+
+    def get_many(self, keys):
+        """{key: feature row or None if failed} for the keys that are in the store"""
+        keys = list(keys)
+        found = {}
+        for start in range(0, len(keys), LOOKUP_BATCH):
+            batch = keys[start:start + LOOKUP_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            for key, number, row in self._db.execute(
+                    f"SELECT key, shard, row FROM rows WHERE key IN ({placeholders})", batch):
+                found[key] = self._row(number, row)
+        return found
+
+    def add(self, keys, features_list):
+        """Append rows (None for failed extractions) as a new shard"""
+        if not keys:
+            return
+        matrix = np.full((len(keys), self.n_features), np.nan, dtype=np.float32)
+        for i, features in enumerate(features_list):
+            if features is not None:
+                matrix[i] = features
+
+        number = self._db.execute("SELECT COALESCE(MAX(number) + 1, 0) FROM shards").fetchone()[0]
+        shard_name = f"features-{number:05d}.npy"
+        np.save(self.path / shard_name, matrix)
+        # The shard is on disk before its keys are committed, so the index
+        # never points at a missing shard
+        with self._db:
+            self._db.execute("INSERT INTO shards VALUES (?, ?)", (number, shard_name))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO rows VALUES (?, ?, ?)",
+                ((key, number, row) for row, key in enumerate(keys))
+            )
+
+    def save(self):
+        """Persist the index (e.g. newly computed file hashes)"""
+        self._db.commit()
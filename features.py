@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Shared Feature Extraction for Cattle vs Buffalo Classification
+Single implementation of the 7-stage feature pipeline used by both
+the training script and the Flask backend
+"""
+
+import logging
+import threading
+import time
+import cv2
+import numpy as np
+
+from lbp import compute_lbp
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the feature layout or the numerics of any stage change,
+# so that serving refuses models trained against different features.
+FEATURE_EXTRACTOR_VERSION = "1"
+
+# Models saved before the version was recorded used the version 1 layout
+LEGACY_EXTRACTOR_VERSION = "1"
+
+IMAGE_SIZE = 224
+HIST_BINS = 32
+LBP_BINS = 16
+
+FEATURE_NAMES = (
+    [f"rgb_hist_{c}_{b}" for c in "rgb" for b in range(HIST_BINS)]
+    + [f"hsv_hist_{c}_{b}" for c in "hsv" for b in range(HIST_BINS)]
+    + [f"lbp_hist_{b}" for b in range(LBP_BINS)]
+    + ["edge_density", "brightness", "contrast", "contour_area", "circularity"]
+    + [f"{c}_{m}" for c in "rgb" for m in ("mean", "std", "skewness")]
+)
+N_FEATURES = len(FEATURE_NAMES)
+
+# Feature columns produced by each optional stage, in the full layout
+STAGE_COLUMNS = {
+    'color_histograms': list(range(0, 192)),
+    'lbp': list(range(192, 208)),
+    'edges_shape': [208, 211, 212],
+    'brightness_contrast': [209, 210],
+    'color_moments': list(range(213, 222)),
+}
+
+# Named subsets of the stages; a model is trained and served with one profile
+FEATURE_PROFILES = {
+    'full': tuple(STAGE_COLUMNS),
+    'lite': ('color_histograms', 'color_moments'),
+    # First stage of the inference cascade
+    'histograms': ('color_histograms',),
+}
+DEFAULT_PROFILE = 'full'
+CASCADE_PROFILE = 'histograms'
+
+# Images processed per pass through a workspace; larger batches are chunked
+# so the per-thread scratch memory stays bounded (about 0.5 MB per image)
+WORKSPACE_BATCH = 16
+
+# Pixel levels of a uint8 plane, and the planes histogrammed by the
+# statistics stage (rows of Workspace.counts)
+LEVELS = np.arange(256, dtype=np.float64)
+PLANES = ('red', 'green', 'blue', 'hue', 'saturation', 'value', 'gray', 'lbp')
+
+
+def profile_columns(profile=DEFAULT_PROFILE):
+    """Indices of a profile's columns in the full feature layout"""
+    if profile not in FEATURE_PROFILES:
+        raise ValueError(f"Unknown feature profile {profile!r} (choose from {', '.join(FEATURE_PROFILES)})")
+    return np.array(sorted(c for stage in FEATURE_PROFILES[profile] for c in STAGE_COLUMNS[stage]))
+
+
+def profile_feature_names(profile=DEFAULT_PROFILE):
+    """Feature names of a profile, in column order"""
+    return [FEATURE_NAMES[c] for c in profile_columns(profile)]
+
+
+def load_image(image_path):
+    """Read an image file from disk as RGB, or None if it cannot be decoded"""
+    image = cv2.imread(str(image_path))
+    if image is None:
+        return None
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def is_compatible(metadata):
+    """Check that a model's metadata matches this feature extractor"""
+    version = metadata.get('feature_extractor_version', LEGACY_EXTRACTOR_VERSION)
+    return str(version) == FEATURE_EXTRACTOR_VERSION
+
+
+def crop_and_resize(image, bbox=None, out=None):
+    """Crop an RGB image to its bounding box and resize to the standard size
+
+    If out is a (224, 224, 3) uint8 array the result is written into it.
+    """
+    if bbox is not None:
+        xmin, ymin, xmax, ymax = (int(v) for v in bbox)
+        image = image[ymin:ymax, xmin:xmax]
+    resized = cv2.resize(image, (IMAGE_SIZE, IMAGE_SIZE), dst=out)
+    if out is not None and resized is not out:
+        out[...] = resized
+    return resized if out is None else out
+
+
+class Workspace:
+    """Reusable scratch buffers for the feature stages
+
+    Holds every intermediate image of extract_crops_features (crops, HSV,
+    gray, LBP codes and bits, Canny edges) and the per-plane histograms
+    for up to `capacity` images, so steady-state extraction only
+    allocates the small per-image outputs. A workspace is not thread
+    safe; get_workspace() keeps one per thread.
+    """
+
+    def __init__(self, capacity=1):
+        self.capacity = 0
+        self.reserve(capacity)
+
+    def reserve(self, capacity):
+        """Grow the buffers to hold at least `capacity` images"""
+        if capacity <= self.capacity:
+            return
+        n = capacity
+        size = IMAGE_SIZE
+        inner = size - 2
+        self.crops = np.zeros((n, size, size, 3), dtype=np.uint8)
+        self.hsv = np.empty((n, size, size, 3), dtype=np.uint8)
+        self.gray = np.empty((n, size, size), dtype=np.uint8)
+        self.lbp = np.empty((n, size, size), dtype=np.uint8)
+        self.lbp_bits = np.empty((n, inner, inner), dtype=bool)
+        self.lbp_shifted = np.empty((n, inner, inner), dtype=np.uint8)
+        self.edges = np.empty((size, size), dtype=np.uint8)
+        self.counts = np.zeros((n, len(PLANES), LEVELS.size), dtype=np.float32)
+        self.full = np.empty((n, N_FEATURES), dtype=np.float32)
+        self.capacity = n
+
+
+_local = threading.local()
+
+
+def get_workspace():
+    """The calling thread's Workspace, created on first use"""
+    workspace = getattr(_local, 'workspace', None)
+    if workspace is None:
+        workspace = _local.workspace = Workspace()
+    return workspace
+
+
+def plane_histograms(images, out=None):
+    """256-bin histogram of every channel of a (N, H, W) or (N, H, W, C) uint8 stack
+
+    Returns (N, C, 256) float32 counts (exact: a crop has far fewer than
+    2**24 pixels), one cv2.calcHist pass per image and channel.
+    """
+    n = images.shape[0]
+    channels = images.shape[3] if images.ndim == 4 else 1
+    if out is None:
+        out = np.empty((n, channels, LEVELS.size), dtype=np.float32)
+    for i in range(n):
+        for c in range(channels):
+            hist = out[i, c].reshape(-1, 1)
+            counts = cv2.calcHist([images[i]], [c], None, [LEVELS.size], [0, 256], hist=hist)
+            if counts is not hist:
+                hist[:] = counts
+    return out
+
+
+def binned_histograms(counts, bins=HIST_BINS):
+    """Merge (N, C, 256) counts into `bins` equal-width bins per channel, (N, C * bins)
+
+    Same counts as cv2.calcHist(..., [bins], [0, 256]) on the pixels.
+    """
+    n, channels, levels = counts.shape
+    return counts.reshape(n, channels, bins, levels // bins).sum(axis=3).reshape(n, channels * bins)
+
+
+def histogram_moments(counts):
+    """Mean, standard deviation and skewness of the pixels behind 256-bin counts
+
+    counts is (..., 256); returns three (...) float64 arrays. The moments
+    are exact sums over the 256 levels weighted by their counts instead of
+    passes over every pixel, so they match np.mean, np.std and
+    a per-pixel skewness up to float64 rounding (skewness is 0 where
+    the standard deviation is 0).
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum(axis=-1)
+    mean = counts @ LEVELS / total
+    deviation = LEVELS - mean[..., None]
+    squared = deviation * deviation
+    std = np.sqrt(np.einsum('...k,...k->...', counts, squared) / total)
+    third = np.einsum('...k,...k->...', counts, squared * deviation) / total
+    with np.errstate(divide='ignore', invalid='ignore'):
+        skewness = np.where(std == 0, 0.0, third / (std * std * std))
+    return mean, std, skewness
+
+
+def edge_and_shape_features(gray, out=None, workspace=None):
+    """Edge density, largest contour area and circularity per image"""
+    if out is None:
+        out = np.empty((gray.shape[0], 3))
+    edges = None if workspace is None else workspace.edges
+    for i, image in enumerate(gray):
+        edges = cv2.Canny(image, 50, 150, edges=edges)
+        out[i, 0] = np.count_nonzero(edges) / (edges.shape[0] * edges.shape[1])
+        out[i, 1:] = 0
+
+        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if contours:
+            largest_contour = max(contours, key=cv2.contourArea)
+            area = cv2.contourArea(largest_contour)
+            perimeter = cv2.arcLength(largest_contour, True)
+            out[i, 1] = area
+            if perimeter > 0:
+                out[i, 2] = 4 * np.pi * area / (perimeter * perimeter)
+    return out
+
+
+def _lap(timings, stage, start):
+    """Add the time since start to timings[stage] and return the current time"""
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + (now - start)
+    return now
+
+
+def extract_crops_features(crops, timings=None, profile=DEFAULT_PROFILE, out=None, workspace=None):
+    """Run the feature stages of a profile over a (N, 224, 224, 3) RGB uint8 stack
+
+    Returns (N, n_columns) float32 with the profile's columns in full
+    layout order, written into out when given. Intermediate images live
+    in the workspace (the calling thread's by default) and batches larger
+    than WORKSPACE_BATCH are processed in chunks. If a timings dict is
+    given, the seconds spent in each stage are added to it (keys:
+    color_convert, lbp, edges_shape, statistics).
+    """
+    columns = profile_columns(profile)
+    n = crops.shape[0]
+    if out is None:
+        out = np.empty((n, len(columns)), dtype=np.float32)
+    if workspace is None:
+        workspace = get_workspace()
+    for begin in range(0, n, WORKSPACE_BATCH):
+        end = min(begin + WORKSPACE_BATCH, n)
+        workspace.reserve(end - begin)
+        _extract_chunk(crops[begin:end], out[begin:end], columns, profile, timings, workspace)
+    return out
+
+
+def _extract_chunk(crops, out, columns, profile, timings, workspace):
+    """Fill out with the profile's features of at most workspace.capacity crops"""
+    stages = FEATURE_PROFILES[profile]
+    n = crops.shape[0]
+    # The full profile is written in place, subsets go through the full layout
+    full = out if len(columns) == N_FEATURES else workspace.full[:n]
+
+    start = time.perf_counter()
+
+    # Per-pixel conversions run over the whole stack in one call
+    flat = crops.reshape(n * IMAGE_SIZE, IMAGE_SIZE, 3)
+    if 'color_histograms' in stages:
+        hsv = workspace.hsv[:n]
+        cv2.cvtColor(flat, cv2.COLOR_RGB2HSV, dst=hsv.reshape(flat.shape))
+    if {'lbp', 'edges_shape', 'brightness_contrast'} & set(stages):
+        gray = workspace.gray[:n]
+        cv2.cvtColor(flat, cv2.COLOR_RGB2GRAY, dst=gray.reshape(flat.shape[:2]))
+    start = _lap(timings, 'color_convert', start)
+
+    # 3. Texture features (LBP codes; their histogram is part of the statistics pass)
+    if 'lbp' in stages:
+        lbp = compute_lbp(gray, out=workspace.lbp[:n],
+                          scratch=(workspace.lbp_bits[:n], workspace.lbp_shifted[:n]))
+        start = _lap(timings, 'lbp', start)
+
+    # 4. Edge features and 6. Shape features
+    if 'edges_shape' in stages:
+        edge_shape = edge_and_shape_features(gray, workspace=workspace)
+        full[:, 208] = edge_shape[:, 0]
+        full[:, 211:213] = edge_shape[:, 1:]
+        start = _lap(timings, 'edges_shape', start)
+
+    # 1./2. RGB and HSV histograms, 3. LBP histogram, 5. brightness and
+    # contrast and 7. color moments all come from one 256-bin histogram
+    # per plane, so every plane is read once
+    counts = workspace.counts[:n]
+    if {'color_histograms', 'color_moments'} & set(stages):
+        plane_histograms(crops, counts[:, 0:3])
+    if 'color_histograms' in stages:
+        plane_histograms(hsv, counts[:, 3:6])
+        full[:, 0:192] = binned_histograms(counts[:, 0:6])
+    if 'brightness_contrast' in stages:
+        plane_histograms(gray, counts[:, 6:7])
+        mean, std, _ = histogram_moments(counts[:, 6])
+        full[:, 209] = mean
+        full[:, 210] = std
+    if 'lbp' in stages:
+        plane_histograms(lbp, counts[:, 7:8])
+        full[:, 192:208] = counts[:, 7, :LBP_BINS]
+    if 'color_moments' in stages:
+        full[:, 213:222] = np.stack(histogram_moments(counts[:, 0:3]), axis=2).reshape(n, 9)
+    _lap(timings, 'statistics', start)
+
+    if full is not out:
+        np.take(full, columns, axis=1, out=out)
+
+
+def extract_features_batch(images, bboxes=None, timings=None, profile=DEFAULT_PROFILE,
+                           out=None, workspace=None):
+    """Extract features for a batch of RGB images
+
+    Returns an (N, n_columns) float32 matrix of the profile's features
+    (N_FEATURES columns for the full profile) in input order, written
+    into out when given. Rows for images that could not be
+    cropped/resized are filled with NaN so one bad image does not fail
+    the whole batch. Per-stage seconds are added to the optional timings
+    dict (crop_resize plus the stages of extract_crops_features).
+    """
+    if bboxes is None:
+        bboxes = [None] * len(images)
+    n = len(images)
+    if out is None:
+        out = np.empty((n, len(profile_columns(profile))), dtype=np.float32)
+    if workspace is None:
+        workspace = get_workspace()
+
+    for begin in range(0, n, WORKSPACE_BATCH):
+        end = min(begin + WORKSPACE_BATCH, n)
+        workspace.reserve(end - begin)
+        start = time.perf_counter()
+        crops = workspace.crops[:end - begin]
+        failed = []
+        for i in range(begin, end):
+            try:
+                crop_and_resize(images[i], bboxes[i], out=crops[i - begin])
+            except Exception as e:
+                logger.error(f"Error preparing image {i} for feature extraction: {e}")
+                crops[i - begin] = 0
+                failed.append(i - begin)
+        _lap(timings, 'crop_resize', start)
+
+        chunk = out[begin:end]
+        extract_crops_features(crops, timings, profile, chunk, workspace)
+        chunk[failed] = np.nan
+    return out
+
+
+def extract_features(image, bbox=None, timings=None, profile=DEFAULT_PROFILE, out=None):
+    """Extract the feature vector of a single RGB image, or None on failure
+
+    out is an optional preallocated float32 row of the profile's length.
+    """
+    row = None if out is None else out.reshape(1, -1)
+    features = extract_features_batch([image], [bbox], timings, profile, out=row)[0]
+    if np.isnan(features).any():
+        return None
+    return features
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Reduced-resolution Image Decoding
+Decodes large JPEG uploads at 1/2, 1/4 or 1/8 scale (libjpeg DCT scaling)
+when the crop would still cover the 224x224 feature input
+"""
+
+from io import BytesIO
+import cv2
+import numpy as np
+
+from features import IMAGE_SIZE
+
+# Decode scale -> OpenCV flag; the JPEG decoder skips DCT coefficients for these
+REDUCED_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    1: cv2.IMREAD_COLOR
+}
+
+# Bytes handed to Pillow for header parsing (APP segments such as EXIF come first)
+HEADER_BYTES = 256 * 1024
+
+# EXIF orientations that rotate the image by 90 degrees (width and height swap)
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def read_header(buffer):
+    """Format and (width, height) after EXIF rotation, from the header only
+
+    Returns (None, None) if Pillow is unavailable or the header is unreadable.
+    """
+    try:
+        from PIL import Image
+        with Image.open(BytesIO(memoryview(buffer)[:HEADER_BYTES])) as image:
+            width, height = image.size
+            if image.getexif().get(0x0112) in TRANSPOSED_ORIENTATIONS:
+                width, height = height, width
+            return image.format, (width, height)
+    except Exception:
+        return None, None
+
+
+def choose_scale(size, bbox=None):
+    """Largest decode scale at which the crop is still at least IMAGE_SIZE on both sides"""
+    width, height = size
+    if bbox is not None:
+        xmin, ymin, xmax, ymax = (float(v) for v in bbox)
+        width, height = xmax - xmin, ymax - ymin
+    for scale in (8, 4, 2):
+        if width / scale >= IMAGE_SIZE and height / scale >= IMAGE_SIZE:
+            return scale
+    return 1
+
+
+def scale_bbox(bbox, scale, shape):
+    """Map a full-resolution bbox onto an image decoded at 1/scale"""
+    if bbox is None or scale == 1:
+        return bbox
+    height, width = shape[:2]
+    xmin, ymin, xmax, ymax = (float(v) for v in bbox)
+    return [
+        min(int(xmin / scale), width),
+        min(int(ymin / scale), height),
+        min(int(np.ceil(xmax / scale)), width),
+        min(int(np.ceil(ymax / scale)), height)
+    ]
+
+
+def decode_image(buffer, bbox=None, reduced=True):
+    """Decode encoded image bytes to BGR, at reduced resolution where possible
+
+    Returns (image, bbox, scale, megapixels): the bbox rescaled to the
+    decoded image, the decode scale (1 = full resolution) and the
+    megapixels of the full-resolution image. Only JPEGs are reduced, since
+    other formats would be fully decoded and then resized by OpenCV.
+    image is None if the bytes cannot be decoded.
+    """
+    image_array = np.frombuffer(buffer, dtype=np.uint8)
+    if image_array.size == 0:
+        return None, bbox, 1, 0.0
+
+    scale = 1
+    image_format, size = read_header(buffer) if reduced else (None, None)
+    if image_format == "JPEG":
+        try:
+            scale = choose_scale(size, bbox)
+        except (TypeError, ValueError):
+            # Malformed bbox: decode fully and let cropping report it
+            scale = 1
+
+    image = cv2.imdecode(image_array, REDUCED_FLAGS[scale])
+    if image is None:
+        return None, bbox, scale, 0.0
+    width, height = size if size else (image.shape[1], image.shape[0])
+    megapixels = width * height / 1e6
+    return image, scale_bbox(bbox, scale, image.shape), scale, megapixels
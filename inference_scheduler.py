@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Dynamic Micro-batching Inference Scheduler
+Collects feature vectors from concurrent requests and runs them through
+the model as one batched predict_proba call
+"""
+
+from concurrent.futures import Future
+import logging
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the batch size histogram buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+# Upper bounds (ms) of the queue wait histogram buckets
+QUEUE_WAIT_BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100)
+
+
+class MicroBatchScheduler:
+    """Queue in front of the model that flushes on batch size or wait time
+
+    A request submits one feature vector and blocks on its Future. The
+    scheduler thread takes the first queued item, keeps collecting until
+    max_batch_size items are queued or max_wait_ms has passed since that
+    first item arrived, then calls predict_proba once on the stacked rows
+    and hands each probability row back to its request. A row submitted
+    with its own predict_proba (the model the request started on) is only
+    batched with rows for the same function, so a model swap never mixes
+    models within a batch.
+    """
+
+    def __init__(self, predict_proba, max_batch_size=32, max_wait_ms=5.0):
+        self._predict_proba = predict_proba
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+        self.batch_size_counts = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+        self.queue_wait_counts = [0] * (len(QUEUE_WAIT_BUCKETS_MS) + 1)
+        self.queue_wait_sum_ms = 0.0
+        self.queue_wait_max_ms = 0.0
+        self.inference_sum_ms = 0.0
+
+    def _ensure_started(self):
+        # Threads don't survive fork, so each worker process starts its own
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._run, name="inference-scheduler", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, features, predict_proba=None):
+        """Queue one feature vector; the Future resolves to its probability row"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((
+            np.asarray(features).ravel(), future, time.perf_counter(), predict_proba or self._predict_proba
+        ))
+        return future
+
+    def predict_proba(self, features, timeout=None, predict_proba=None):
+        """Blocking single-row predict_proba through the batching queue"""
+        return self.submit(features, predict_proba).result(timeout=timeout)
+
+    def _collect_batch(self):
+        first = self._queue.get()
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                # Still take whatever is already queued without waiting
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            flush_time = time.perf_counter()
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[3], []).append(item)
+            error = False
+            for predict_proba, items in groups.items():
+                try:
+                    X = np.stack([features for features, _, _, _ in items])
+                    probabilities = predict_proba(X)
+                    for (_, future, _, _), row in zip(items, probabilities):
+                        future.set_result(row)
+                except Exception as e:
+                    logger.error(f"Batched inference failed for {len(items)} requests: {e}")
+                    for _, future, _, _ in items:
+                        future.set_exception(e)
+                    error = True
+            self._record(batch, flush_time, time.perf_counter(), error)
+
+    def _record(self, batch, flush_time, done_time, error):
+        size = len(batch)
+        waits_ms = [(flush_time - enqueued) * 1000 for _, _, enqueued, _ in batch]
+        with self._stats_lock:
+            self.requests += size
+            self.batches += 1
+            self.errors += int(error)
+            self.batch_size_counts[np.searchsorted(BATCH_SIZE_BUCKETS, size)] += 1
+            for wait_ms in waits_ms:
+                self.queue_wait_counts[np.searchsorted(QUEUE_WAIT_BUCKETS_MS, wait_ms)] += 1
+            self.queue_wait_sum_ms += sum(waits_ms)
+            self.queue_wait_max_ms = max(self.queue_wait_max_ms, max(waits_ms))
+            self.inference_sum_ms += (done_time - flush_time) * 1000
+
+    def histogram_counts(self):
+        """Raw per-bucket counts (last bucket is the overflow) for metric exporters"""
+        with self._stats_lock:
+            return {
+                'batch_size': list(self.batch_size_counts),
+                'queue_wait': list(self.queue_wait_counts),
+                'requests': self.requests,
+                'queue_wait_sum_ms': self.queue_wait_sum_ms
+            }
+
+    def stats(self):
+        """Batch size and queue wait metrics"""
+        with self._stats_lock:
+            batch_labels = [f"<={b}" for b in BATCH_SIZE_BUCKETS] + [f">{BATCH_SIZE_BUCKETS[-1]}"]
+            wait_labels = [f"<={b}ms" for b in QUEUE_WAIT_BUCKETS_MS] + [f">{QUEUE_WAIT_BUCKETS_MS[-1]}ms"]
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'queue_depth': self._queue.qsize(),
+                'requests': self.requests,
+                'batches': self.batches,
+                'errors': self.errors,
+                'mean_batch_size': self.requests / self.batches if self.batches else 0.0,
+                'batch_size_histogram': dict(zip(batch_labels, self.batch_size_counts)),
+                'mean_queue_wait_ms': self.queue_wait_sum_ms / self.requests if self.requests else 0.0,
+                'max_queue_wait_ms': self.queue_wait_max_ms,
+                'queue_wait_histogram': dict(zip(wait_labels, self.queue_wait_counts)),
+                'mean_batch_inference_ms': self.inference_sum_ms / self.batches if self.batches else 0.0
+            }
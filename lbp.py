@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Vectorized Local Binary Pattern (LBP) texture engine
+Shared by the Flask backend and the training script
+"""
+
+from functools import lru_cache
+import numpy as np
+
+
+@lru_cache(maxsize=32)
+def neighbour_offsets(rows, cols, radius=1, n_points=8):
+    """Precompute neighbour indices for every interior pixel of a rows x cols image
+
+    The sample positions reproduce the original per-pixel loop exactly:
+    ``int(i + radius * cos(angle))`` is evaluated for every row and column
+    index, so floating point truncation quirks near integer boundaries give
+    the same neighbour as before. Each entry is ``(row_index, col_index,
+    valid)`` where the indices are slices when the offset is constant (the
+    common case) and index arrays otherwise, and ``valid`` is a boolean mask
+    (or None when every neighbour is in bounds).
+    """
+    inner_rows = np.arange(radius, rows - radius)
+    inner_cols = np.arange(radius, cols - radius)
+
+    offsets = []
+    for k in range(n_points):
+        angle = 2 * np.pi * k / n_points
+        x = (inner_rows + radius * np.cos(angle)).astype(np.intp)
+        y = (inner_cols + radius * np.sin(angle)).astype(np.intp)
+
+        # Out of bounds neighbours contribute a '0' bit
+        valid_x = x < rows
+        valid_y = y < cols
+        if valid_x.all() and valid_y.all():
+            valid = None
+        else:
+            valid = valid_x[:, None] & valid_y[None, :]
+
+        offsets.append((
+            _as_index(np.minimum(x, rows - 1)),
+            _as_index(np.minimum(y, cols - 1)),
+            valid,
+        ))
+
+    return tuple(offsets)
+
+
+def _as_index(indices):
+    """Return a slice when indices are a contiguous run, else the index array"""
+    if len(indices) and np.all(np.diff(indices) == 1):
+        return slice(int(indices[0]), int(indices[-1]) + 1)
+    return indices
+
+
+def _code_dtype(n_points):
+    """Smallest unsigned dtype that holds an n_points bit code"""
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if n_points <= np.iinfo(dtype).bits:
+            return dtype
+    raise ValueError(f"n_points must be <= 64, got {n_points}")
+
+
+def compute_lbp(image, radius=1, n_points=8, out=None, scratch=None):
+    """Compute Local Binary Pattern
+
+    Accepts a single grayscale image (rows, cols) or a stack of them
+    (..., rows, cols). Codes are bit-identical to the original per-pixel
+    implementation: the first sample point is the most significant bit and
+    the ``radius`` wide border is left at 0.
+
+    ``out`` (the image's shape, code dtype) receives the codes instead of a
+    new array. ``scratch`` is an optional (bool, code dtype) pair of arrays
+    shaped like the interior (..., rows - 2 * radius, cols - 2 * radius)
+    that holds the per-neighbour bits, so repeated calls allocate nothing.
+    """
+    image = np.asarray(image)
+    rows, cols = image.shape[-2:]
+    dtype = _code_dtype(n_points)
+    if out is None:
+        lbp = np.zeros(image.shape, dtype=dtype)
+    else:
+        lbp = out
+        lbp.fill(0)
+
+    if rows <= 2 * radius or cols <= 2 * radius:
+        return lbp
+
+    center = image[..., radius:rows - radius, radius:cols - radius]
+    codes = lbp[..., radius:rows - radius, radius:cols - radius]
+    if scratch is None:
+        scratch = (np.empty(center.shape, dtype=bool), np.empty(center.shape, dtype=dtype))
+    bit, shifted = scratch
+
+    for k, (row_index, col_index, valid) in enumerate(
+            neighbour_offsets(rows, cols, radius, n_points)):
+        if isinstance(row_index, slice) or isinstance(col_index, slice):
+            neighbour = image[..., row_index, :][..., col_index]
+        else:
+            neighbour = image[..., row_index[:, None], col_index[None, :]]
+
+        np.greater_equal(neighbour, center, out=bit)
+        if valid is not None:
+            bit &= valid
+        np.left_shift(bit, dtype(n_points - 1 - k), out=shifted, dtype=dtype)
+        codes |= shifted
+
+    return lbp
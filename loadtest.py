@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Load Generator for the Cattle vs Buffalo Classification API
+Drives /api/classify at a fixed request rate or with a fixed number of
+concurrent clients and reports throughput, latency percentiles and errors
+"""
+
+import argparse
+import base64
+import itertools
+import json
+import random
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import cv2
+import numpy as np
+import pandas as pd
+import requests
+
+from benchmark import create_test_image
+
+PERCENTILES = (50, 90, 99)
+
+# Synthetic image sizes (width, height) mixed in with the dataset images
+SYNTHETIC_SIZES = ((320, 240), (640, 480), (1280, 720))
+
+
+def load_dataset_payloads(dataset_path, limit):
+    """Encoded image bytes and bbox of up to limit annotated dataset images"""
+    payloads = []
+    for split in ("test", "valid", "train"):
+        annotations = Path(dataset_path) / split / "_annotations.csv"
+        if not annotations.exists():
+            continue
+        df = pd.read_csv(annotations)
+        for row in df.itertuples(index=False):
+            if len(payloads) >= limit:
+                return payloads
+            image_path = Path(dataset_path) / split / row.filename
+            if not image_path.exists():
+                continue
+            bbox = [int(row.xmin), int(row.ymin), int(row.xmax), int(row.ymax)]
+            payloads.append({"name": row.filename, "image": image_path.read_bytes(), "bbox": bbox})
+    return payloads
+
+
+def synthetic_payloads(count):
+    """JPEG-encoded synthetic images with distinct seeds, cycling through SYNTHETIC_SIZES"""
+    payloads = []
+    for i in range(count):
+        width, height = SYNTHETIC_SIZES[i % len(SYNTHETIC_SIZES)]
+        image = create_test_image(width, height, seed=i)
+        _, buffer = cv2.imencode(".jpg", cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+        payloads.append({"name": f"synthetic_{width}x{height}_{i}", "image": buffer.tobytes(), "bbox": None})
+    return payloads
+
+
+def unique_image_bytes(image, token):
+    """image with token embedded so its bytes (and result cache key) are unique
+
+    JPEGs get a comment (COM) segment after the SOI marker, other formats
+    get the token appended after the image data; decoders ignore both, so
+    the server still decodes the same pixels.
+    """
+    token = token.encode("ascii")
+    if image[:2] == b"\xff\xd8":
+        return image[:2] + b"\xff\xfe" + struct.pack(">H", len(token) + 2) + token + image[2:]
+    return image + token
+
+
+def send_request(session, url, payload, request_format):
+    """POST one image; returns (status code, error message or None)"""
+    try:
+        if request_format == "json":
+            # Same payload as the web frontend and test_system.py
+            body = {
+                "image": "data:image/jpeg;base64," + base64.b64encode(payload["image"]).decode("utf-8"),
+                "bbox": payload["bbox"]
+            }
+            response = session.post(url, json=body, timeout=60)
+        else:
+            params = {"bbox": ",".join(map(str, payload["bbox"]))} if payload["bbox"] else None
+            response = session.post(
+                url, data=payload["image"], params=params, timeout=60,
+                headers={"Content-Type": "application/octet-stream"}
+            )
+        if response.status_code != 200:
+            return response.status_code, response.text[:200]
+        return 200, None
+    except requests.exceptions.RequestException as e:
+        return 0, type(e).__name__
+
+
+class LoadGenerator:
+    """Runs one load test and collects (offset, latency, status) samples"""
+
+    def __init__(self, url, payloads, request_format="binary", unique=True):
+        self.url = url
+        self.payloads = payloads
+        self.request_format = request_format
+        # When unique, every request gets distinct bytes so the result cache never answers
+        self.unique = unique
+        self._counter = itertools.count()
+        self.samples = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.start_time = None
+
+    def _session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _one(self, payload, scheduled):
+        if self.unique:
+            token = f"loadtest-{next(self._counter)}-{random.getrandbits(32):08x}"
+            payload = dict(payload, image=unique_image_bytes(payload["image"], token))
+        status, error = send_request(self._session(), self.url, payload, self.request_format)
+        done = time.perf_counter()
+        with self._lock:
+            # Latency counts from the scheduled send time, so queueing behind a
+            # slow server is measured instead of hidden (coordinated omission)
+            self.samples.append((scheduled - self.start_time, done - scheduled, status, error))
+
+    def run_concurrency(self, clients, duration):
+        """Closed loop: each client sends its next request when the last one returns"""
+        self.start_time = time.perf_counter()
+        deadline = self.start_time + duration
+
+        def client(index):
+            rng = random.Random(index)
+            while time.perf_counter() < deadline:
+                self._one(rng.choice(self.payloads), time.perf_counter())
+
+        threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_rate(self, rate, duration, max_in_flight):
+        """Open loop: send rate requests per second regardless of response times"""
+        self.start_time = time.perf_counter()
+        rng = random.Random(0)
+        interval = 1.0 / rate
+        with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+            for i in range(int(rate * duration)):
+                scheduled = self.start_time + i * interval
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self._one, rng.choice(self.payloads), scheduled)
+
+
+def percentile_ms(latencies, q):
+    return float(np.percentile(latencies, q) * 1000) if len(latencies) else 0.0
+
+
+def summarize_run(samples, warmup, wall_seconds):
+    """Throughput, latency percentiles, errors and a per-second timeline"""
+    measured = [s for s in samples if s[0] >= warmup]
+    ok = np.array([latency for _, latency, status, _ in measured if status == 200])
+    errors = {}
+    for _, _, status, error in measured:
+        if status != 200:
+            key = str(status) if status else error
+            errors[key] = errors.get(key, 0) + 1
+
+    window = max(wall_seconds - warmup, 1e-9)
+    summary = {
+        "requests": len(measured),
+        "successful": int(len(ok)),
+        "error_rate": (len(measured) - len(ok)) / len(measured) if measured else 0.0,
+        "errors": errors,
+        "throughput_rps": len(ok) / window,
+        "latency_ms": {f"p{q}": percentile_ms(ok, q) for q in PERCENTILES},
+        "timeline": []
+    }
+    summary["latency_ms"]["mean"] = float(ok.mean() * 1000) if len(ok) else 0.0
+    summary["latency_ms"]["max"] = float(ok.max() * 1000) if len(ok) else 0.0
+
+    last_second = int(max(s[0] for s in samples)) if samples else -1
+    for second in range(last_second + 1):
+        bucket = [s for s in samples if second <= s[0] < second + 1]
+        latencies = np.array([latency for _, latency, status, _ in bucket if status == 200])
+        summary["timeline"].append({
+            "second": second,
+            "requests": len(bucket),
+            "errors": sum(1 for s in bucket if s[2] != 200),
+            "p50_ms": percentile_ms(latencies, 50),
+            "p99_ms": percentile_ms(latencies, 99)
+        })
+    return summary
+
+
+def print_summary(summary):
+    latency = summary["latency_ms"]
+    print(f"\nRequests:    {summary['requests']} ({summary['successful']} ok)")
+    print(f"Throughput:  {summary['throughput_rps']:.1f} req/s")
+    print(f"Error rate:  {summary['error_rate']:.2%} {summary['errors'] or ''}")
+    print(f"Latency:     p50 {latency['p50']:.1f} ms | p90 {latency['p90']:.1f} ms | "
+          f"p99 {latency['p99']:.1f} ms | max {latency['max']:.1f} ms")
+
+    print(f"\n{'Second':>6} {'Requests':>9} {'Errors':>7} {'p50 ms':>9} {'p99 ms':>9}")
+    for point in summary["timeline"]:
+        print(f"{point['second']:>6} {point['requests']:>9} {point['errors']:>7} "
+              f"{point['p50_ms']:>9.1f} {point['p99_ms']:>9.1f}")
+
+
+def compare_runs(baseline, current):
+    """Print throughput and latency of two saved runs side by side"""
+    rows = [("throughput_rps", baseline["summary"]["throughput_rps"], current["summary"]["throughput_rps"])]
+    rows += [("error_rate", baseline["summary"]["error_rate"], current["summary"]["error_rate"])]
+    rows += [
+        (f"latency {key} (ms)", baseline["summary"]["latency_ms"][key], current["summary"]["latency_ms"][key])
+        for key in ("p50", "p90", "p99", "max")
+    ]
+    print(f"\nComparison with {baseline['config'].get('label') or 'baseline'}:")
+    print(f"{'Metric':<20} {'Baseline':>10} {'Current':>10} {'Change':>8}")
+    print("-" * 51)
+    for name, before, after in rows:
+        change = f"{(after - before) / before:+.1%}" if before else "n/a"
+        print(f"{name:<20} {before:>10.3f} {after:>10.3f} {change:>8}")
+
+
+def fetch_cache_stats(url):
+    """Result cache counters of the server, or None if unavailable"""
+    try:
+        response = requests.get(url.rsplit("/api/", 1)[0] + "/api/cache_stats", timeout=5)
+        return response.json() if response.status_code == 200 else None
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+
+
+def cache_usage(before, after):
+    """Result cache size and hits/misses during the run (from one server process)"""
+    if before is None or after is None:
+        return None
+    hits = after["hits"] - before["hits"]
+    misses = after["misses"] - before["misses"]
+    return {
+        "active": after["max_entries"] > 0,
+        "max_entries": after["max_entries"],
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / (hits + misses) if hits + misses > 0 else 0.0
+    }
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Load generator for the classify API")
+    parser.add_argument("--url", default="http://localhost:5000/api/classify", help="Classify endpoint")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--concurrency", type=int, default=4,
+                      help="Closed loop: number of clients sending back-to-back (default)")
+    mode.add_argument("--rate", type=float, default=None,
+                      help="Open loop: requests per second, independent of response times")
+    parser.add_argument("--max-in-flight", type=int, default=64,
+                        help="Connection limit in --rate mode")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to generate load")
+    parser.add_argument("--warmup", type=float, default=2.0,
+                        help="Leading seconds excluded from the summary")
+    parser.add_argument("--dataset", default="cow-and-buffalo.v1i.tensorflow",
+                        help="Dataset folder providing real images")
+    parser.add_argument("--real-images", type=int, default=50, help="Number of dataset images to use")
+    parser.add_argument("--synthetic-images", type=int, default=50, help="Number of synthetic images to use")
+    parser.add_argument("--format", choices=["binary", "json"], default="binary",
+                        help="Raw image body with bbox in the query, or base64 JSON")
+    parser.add_argument("--cache-hits", action="store_true",
+                        help="Resend identical image bytes so the server's result cache can answer "
+                             "(default: every request is made unique to measure extraction and inference)")
+    parser.add_argument("--label", default=None, help="Name stored with the saved run")
+    parser.add_argument("--output", default=None, help="Save the run as JSON")
+    parser.add_argument("--compare", default=None, help="Saved run to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Build the image mix, run the load test, report and save"""
+    args = parse_args(argv)
+
+    print("Cattle vs Buffalo API Load Test")
+    print("=" * 50)
+
+    payloads = load_dataset_payloads(args.dataset, args.real_images)
+    real_count = len(payloads)
+    payloads += synthetic_payloads(args.synthetic_images)
+    if not payloads:
+        print("❌ No images to send")
+        return 1
+    print(f"Image mix: {real_count} dataset + {len(payloads) - real_count} synthetic")
+
+    try:
+        requests.get(args.url.rsplit("/api/", 1)[0] + "/api/health", timeout=5)
+    except requests.exceptions.ConnectionError:
+        print(f"❌ Cannot connect to {args.url}. Make sure the server is running.")
+        return 1
+
+    cache_before = fetch_cache_stats(args.url)
+    generator = LoadGenerator(args.url, payloads, args.format, unique=not args.cache_hits)
+    if args.rate:
+        print(f"Sending {args.rate:g} req/s for {args.duration:g}s...")
+        generator.run_rate(args.rate, args.duration, args.max_in_flight)
+    else:
+        print(f"Running {args.concurrency} concurrent clients for {args.duration:g}s...")
+        generator.run_concurrency(args.concurrency, args.duration)
+    wall_seconds = time.perf_counter() - generator.start_time
+    cache = cache_usage(cache_before, fetch_cache_stats(args.url))
+
+    summary = summarize_run(generator.samples, args.warmup, wall_seconds)
+    print_summary(summary)
+    if cache is None:
+        print("\nResult cache: stats unavailable")
+    else:
+        print(f"\nResult cache: {'active' if cache['active'] else 'disabled'} "
+              f"({cache['hits']} hits, {cache['misses']} misses, hit rate {cache['hit_rate']:.1%})")
+
+    run = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "label": args.label,
+            "url": args.url,
+            "mode": "rate" if args.rate else "concurrency",
+            "rate": args.rate,
+            "concurrency": None if args.rate else args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "format": args.format,
+            "real_images": real_count,
+            "synthetic_images": len(payloads) - real_count,
+            "unique_payloads": not args.cache_hits
+        },
+        "result_cache": cache,
+        "summary": summary
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"\nRun saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare_runs(json.load(f), run)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped Model Artifact Format
+Saves trained models as a directory of raw .npy arrays that server
+processes open with mmap, so every worker shares one page-cached copy
+"""
+
+from pathlib import Path
+import hashlib
+import json
+import os
+import joblib
+import numpy as np
+
+ARTIFACT_SUFFIX = ".mmap"
+MANIFEST_FILE = "manifest.json"
+
+# Node arrays of a flattened forest, in file order
+FOREST_ARRAYS = ("children_left", "children_right", "feature", "threshold", "value", "roots")
+
+# Derived arrays saved with new artifacts (computed on load for older ones)
+COMPILED_ARRAYS = ("children",)
+
+
+class FlatForestClassifier:
+    """Random forest classifier evaluated from flat node arrays
+
+    sklearn's Tree copies its node buffers when unpickled, so a forest
+    loaded with joblib can never be shared between processes. This class
+    keeps all trees as contiguous arrays (child indices are global, -1
+    marks a leaf, leaf values are per-tree class probabilities), which can
+    be memory-mapped read-only. It is also the compiled form used for
+    inference: every tree is evaluated for every row in one vectorized
+    pass, without sklearn's per-call validation and per-tree dispatch.
+    predict_proba matches sklearn's RandomForestClassifier.predict_proba
+    exactly (rows containing NaN are not supported).
+    """
+
+    def __init__(self, arrays, classes, n_features):
+        self.children_left = arrays["children_left"]
+        self.children_right = arrays["children_right"]
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.value = arrays["value"]
+        self.roots = arrays["roots"]
+        # Both children of node i at 2i (right) and 2i + 1 (left), indexed by the split result
+        children = arrays.get("children")
+        if children is None:
+            children = np.stack([self.children_right, self.children_left], axis=1).ravel()
+        self.children = children
+        self.classes_ = np.asarray(classes)
+        self.n_features_in_ = n_features
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    @classmethod
+    def from_sklearn(cls, forest):
+        """Flatten a fitted sklearn forest classifier"""
+        parts = {name: [] for name in FOREST_ARRAYS if name != "roots"}
+        roots = []
+        offset = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            left = tree.children_left.astype(np.int64)
+            right = tree.children_right.astype(np.int64)
+            is_split = left != -1
+            left[is_split] += offset
+            right[is_split] += offset
+
+            # Leaf values exactly as DecisionTreeClassifier.predict_proba returns them:
+            # older sklearn stores class counts and normalizes them there, newer
+            # versions store the class fractions and return them as they are
+            value = tree.value[:, 0, :].astype(np.float64)
+            if not np.isclose(value[0].sum(), 1.0):
+                normalizer = value.sum(axis=1)[:, np.newaxis]
+                normalizer[normalizer == 0.0] = 1.0
+                value /= normalizer
+
+            parts["children_left"].append(left)
+            parts["children_right"].append(right)
+            parts["feature"].append(tree.feature.astype(np.int64))
+            parts["threshold"].append(tree.threshold.astype(np.float64))
+            parts["value"].append(value)
+            roots.append(offset)
+            offset += tree.node_count
+
+        arrays = {name: np.concatenate(chunks) for name, chunks in parts.items()}
+        arrays["roots"] = np.asarray(roots, dtype=np.int64)
+        return cls(arrays, forest.classes_, forest.n_features_in_)
+
+    def apply(self, X):
+        """Leaf index reached in every tree, shape (n_trees, n_rows)
+
+        All (tree, row) paths descend one level per step together; paths
+        that reached a leaf are dropped, so each step only works on the
+        paths still inside a tree.
+        """
+        # Same float32 cast as sklearn before comparing against thresholds
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(
+                f"X has {X.shape[-1]} features, but the model expects {self.n_features_in_}"
+            )
+        n_rows, n_features = X.shape
+        values = X.ravel()
+        leaves = np.empty(self.n_estimators * n_rows, dtype=np.int64)
+
+        node = np.repeat(self.roots, n_rows)
+        offset = np.tile(np.arange(n_rows, dtype=np.int64) * n_features, self.n_estimators)
+        path = np.arange(node.size)
+        while node.size:
+            # Leaves have a negative feature index (sklearn's TREE_UNDEFINED)
+            feature = self.feature[node]
+            is_leaf = feature < 0
+            if is_leaf.any():
+                leaves[path[is_leaf]] = node[is_leaf]
+                keep = ~is_leaf
+                node, feature, offset, path = node[keep], feature[keep], offset[keep], path[keep]
+            go_left = values[offset + feature] <= self.threshold[node]
+            node = self.children[2 * node + go_left]
+
+        return leaves.reshape(self.n_estimators, n_rows)
+
+    def predict_proba(self, X):
+        """Average of the per-tree leaf class probabilities"""
+        # Summed tree by tree in order, as sklearn does, so results are identical
+        proba = self.value[self.apply(X)].sum(axis=0)
+        proba /= self.n_estimators
+        return proba
+
+    def predict_with_proba(self, X):
+        """(labels, probabilities) from a single pass over the forest"""
+        proba = self.predict_proba(X)
+        return self.classes_.take(np.argmax(proba, axis=1), axis=0), proba
+
+    def predict(self, X):
+        return self.predict_with_proba(X)[0]
+
+
+def is_forest(model):
+    """True for fitted sklearn forest classifiers (RandomForest, ExtraTrees)"""
+    estimators = getattr(model, "estimators_", None)
+    return (
+        hasattr(model, "predict_proba")
+        and getattr(model, "n_outputs_", 1) == 1
+        and isinstance(estimators, list)
+        and len(estimators) > 0
+        and all(hasattr(estimator, "tree_") for estimator in estimators)
+    )
+
+
+def compile_model(model):
+    """Compile a fitted sklearn forest into a FlatForestClassifier; other models pass through"""
+    return FlatForestClassifier.from_sklearn(model) if is_forest(model) else model
+
+
+def predict_with_proba(model, X):
+    """(labels, probabilities) of any classifier, in one evaluation where supported"""
+    if hasattr(model, "predict_with_proba"):
+        return model.predict_with_proba(X)
+    from sklearn.calibration import CalibratedClassifierCV
+    final = model.steps[-1][1] if hasattr(model, "steps") else model
+    if isinstance(final, CalibratedClassifierCV):
+        # Calibrated classifiers predict the most probable class
+        proba = model.predict_proba(X)
+        return model.classes_.take(np.argmax(proba, axis=1)), proba
+    return model.predict(X), model.predict_proba(X)
+
+
+def cascade_model_path(model_path):
+    """Path prefix of the cascade first-stage model saved next to a model"""
+    return f"{model_path}_stage1"
+
+
+def artifact_path(model_path):
+    """Directory name of the mmap artifact for a model path prefix"""
+    return Path(f"{model_path}{ARTIFACT_SUFFIX}")
+
+
+def save_artifact(model, path):
+    """Write model as a memory-mappable artifact directory
+
+    Forests are flattened into raw node arrays. Other models are dumped
+    uncompressed with joblib, which stores their numpy arrays so they can
+    be memory-mapped on load.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    for old_file in path.iterdir():
+        if old_file.suffix in (".npy", ".joblib", ".json"):
+            old_file.unlink()
+    digest = hashlib.sha256()
+
+    if is_forest(model):
+        flat = FlatForestClassifier.from_sklearn(model)
+        for name in FOREST_ARRAYS + COMPILED_ARRAYS:
+            array = np.ascontiguousarray(getattr(flat, name))
+            np.save(path / f"{name}.npy", array)
+            digest.update(array.tobytes())
+        manifest = {
+            "kind": "flat_forest",
+            "model_type": type(model).__name__,
+            "classes": flat.classes_.tolist(),
+            "n_features": int(flat.n_features_in_),
+            "n_estimators": flat.n_estimators,
+            "n_nodes": int(len(flat.feature))
+        }
+    else:
+        joblib.dump(model, path / "model.joblib")
+        with open(path / "model.joblib", "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        manifest = {
+            "kind": "joblib",
+            "model_type": type(model).__name__
+        }
+
+    manifest["content_hash"] = digest.hexdigest()[:16]
+    with open(path / MANIFEST_FILE, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_artifact(path):
+    """Open an artifact directory with memory mapping; returns (model, manifest)"""
+    path = Path(path)
+    with open(path / MANIFEST_FILE, "r") as f:
+        manifest = json.load(f)
+
+    if manifest["kind"] == "flat_forest":
+        arrays = {
+            name: np.load(path / f"{name}.npy", mmap_mode="r")
+            for name in FOREST_ARRAYS + COMPILED_ARRAYS
+            if name in FOREST_ARRAYS or (path / f"{name}.npy").exists()
+        }
+        model = FlatForestClassifier(arrays, manifest["classes"], manifest["n_features"])
+    else:
+        # Copy-on-write mapping: pages stay shared unless a caller writes to
+        # them (libsvm rejects read-only buffers)
+        model = joblib.load(path / "model.joblib", mmap_mode="c")
+
+    return model, manifest
+
+
+def load_model_file(model_path, compiled=True):
+    """Load a model by path prefix, as the server does; returns (model, description)
+
+    The {model_path}.mmap/ artifact is preferred when it is at least as new
+    as {model_path}.joblib. Forests loaded from joblib are compiled into a
+    FlatForestClassifier unless compiled=False. Returns (None, None) if
+    neither exists.
+    """
+    mmap_path = artifact_path(model_path)
+    joblib_path = Path(f"{model_path}.joblib")
+    manifest_path = mmap_path / MANIFEST_FILE
+    if manifest_path.exists() and (
+        not joblib_path.exists() or manifest_path.stat().st_mtime >= joblib_path.stat().st_mtime
+    ):
+        model, manifest = load_artifact(mmap_path)
+        return model, f"mmap artifact {mmap_path} ({manifest['kind']})"
+    if joblib_path.exists():
+        model = joblib.load(joblib_path)
+        if compiled and is_forest(model):
+            return compile_model(model), f"joblib {joblib_path} (compiled forest)"
+        return model, f"joblib {joblib_path}"
+    return None, None
+
+
+def load_metadata(model_path):
+    """Training metadata saved next to a model ({model_path}_metadata.json), or {}"""
+    metadata_path = Path(f"{model_path}_metadata.json")
+    if not metadata_path.exists():
+        return {}
+    with open(metadata_path, "r") as f:
+        return json.load(f)
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB (peak RSS where /proc is unavailable)"""
+    try:
+        with open(f"/proc/{os.getpid()}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        return 0.0
+
+
+def mapped_bytes(path):
+    """Total size of the memory-mappable files in an artifact"""
+    return sum(p.stat().st_size for p in Path(path).iterdir() if p.suffix in (".npy", ".joblib"))
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Versioned Model Registry
+Stores every published model (joblib and/or mmap artifact, metadata and
+cascade first stage) in its own version directory, and records which
+version the servers should serve
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+
+from model_artifact import artifact_path, cascade_model_path, load_metadata, ARTIFACT_SUFFIX, MANIFEST_FILE
+
+DEFAULT_REGISTRY = "model_registry"
+
+# Active version and rollback history, replaced atomically on every change
+STATE_FILE = "registry.json"
+
+# Publication details stored inside each version directory
+VERSION_FILE = "version.json"
+
+# Model path prefix inside a version directory (model.joblib, model.mmap/, ...)
+MODEL_NAME = "model"
+
+VERSION_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+
+def _write_json_atomic(path, data):
+    """Write JSON to a temporary file and rename it over path"""
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(temp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def saved_artifacts(model_path, metadata):
+    """Suffixes (".joblib", ".mmap", "_stage1.joblib", ...) of the files saved for a model
+
+    Models saved by train_model list them under 'artifacts' in their
+    metadata. For older metadata the mmap artifact is taken only if it is
+    at least as new as the joblib file (the rule the server loads by), and
+    the first stage only if the metadata has a cascade.
+    """
+    if "artifacts" in metadata:
+        return metadata["artifacts"]
+    suffixes = []
+    for stage in [""] + ([cascade_model_path("")] if "cascade" in metadata else []):
+        joblib_file = Path(f"{model_path}{stage}.joblib")
+        manifest = artifact_path(f"{model_path}{stage}") / MANIFEST_FILE
+        if joblib_file.exists():
+            suffixes.append(f"{stage}.joblib")
+        if manifest.exists() and (not joblib_file.exists()
+                                  or manifest.stat().st_mtime >= joblib_file.stat().st_mtime):
+            suffixes.append(f"{stage}{ARTIFACT_SUFFIX}")
+    return suffixes
+
+
+def model_files(model_path):
+    """(source, name inside a version directory) of every file saved for a model path prefix
+
+    Only the files of the current save are included, never a .mmap/ or
+    _stage1 model left over from an earlier training run.
+    """
+    metadata_path = Path(f"{model_path}_metadata.json")
+    if not metadata_path.exists():
+        return []
+    files = []
+    for suffix in saved_artifacts(model_path, load_metadata(model_path)):
+        source = Path(f"{model_path}{suffix}")
+        if not source.exists():
+            raise ValueError(f"{source} is listed in the model metadata but missing")
+        files.append((source, f"{MODEL_NAME}{suffix}"))
+    files.append((metadata_path, f"{MODEL_NAME}_metadata.json"))
+    return files
+
+
+class ModelRegistry:
+    """Directory of model versions plus the active-version pointer
+
+    Layout: {root}/{version}/model.joblib (and/or model.mmap/),
+    model_metadata.json, optional model_stage1.* and version.json, and
+    {root}/registry.json with the active version and the versions that
+    were active before it (most recent last), used for rollback.
+    """
+
+    def __init__(self, root=DEFAULT_REGISTRY):
+        self.root = Path(root)
+
+    def model_path(self, version):
+        """Model path prefix of a version, as accepted by load_model_file"""
+        return str(self.root / version / MODEL_NAME)
+
+    def exists(self, version):
+        return bool(VERSION_PATTERN.match(version)) and (self.root / version / VERSION_FILE).exists()
+
+    def state(self):
+        """{'active': version or None, 'history': [...]}"""
+        try:
+            with open(self.root / STATE_FILE, "r") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        return {"active": state.get("active"), "history": list(state.get("history", []))}
+
+    def active_version(self):
+        return self.state()["active"]
+
+    def versions(self):
+        """Published versions, oldest first, with a summary of their metadata"""
+        if not self.root.is_dir():
+            return []
+        active = self.active_version()
+        versions = []
+        for path in self.root.iterdir():
+            if not (path / VERSION_FILE).exists():
+                continue
+            with open(path / VERSION_FILE, "r") as f:
+                info = json.load(f)
+            metadata = load_metadata(self.model_path(path.name))
+            info.update({
+                "model_type": metadata.get("model_type"),
+                "feature_profile": metadata.get("feature_profile", "full"),
+                "feature_extractor_version": metadata.get("feature_extractor_version"),
+                "cascade": "cascade" in metadata,
+                "active": path.name == active
+            })
+            versions.append(info)
+        return sorted(versions, key=lambda info: (info["created"], info["version"]))
+
+    def _next_version(self):
+        numbers = [int(p.name[1:]) for p in self.root.iterdir() if re.fullmatch(r"v\d+", p.name)]
+        return f"v{max(numbers, default=0) + 1}"
+
+    def publish(self, model_path, version=None):
+        """Copy a saved model (by path prefix) into a new version; returns the version
+
+        The version is assembled in a hidden directory and renamed into
+        place, so servers never see a partially copied version.
+        """
+        files = model_files(model_path)
+        names = {name for _, name in files}
+        if f"{MODEL_NAME}_metadata.json" not in names or not names & {f"{MODEL_NAME}.joblib", f"{MODEL_NAME}.mmap"}:
+            raise ValueError(f"No saved model and metadata found for {model_path}")
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        version = version or self._next_version()
+        if not VERSION_PATTERN.match(version):
+            raise ValueError(f"Invalid version name {version!r}")
+        target = self.root / version
+        if target.exists():
+            raise ValueError(f"Version {version} already exists")
+
+        staging = self.root / f".{version}.{os.getpid()}.tmp"
+        staging.mkdir()
+        try:
+            for source, name in files:
+                if source.is_dir():
+                    shutil.copytree(source, staging / name)
+                else:
+                    shutil.copy2(source, staging / name)
+            _write_json_atomic(staging / VERSION_FILE, {
+                "version": version,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "source": str(Path(model_path).resolve())
+            })
+            os.rename(staging, target)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return version
+
+    def activate(self, version):
+        """Make version the active one; the previous active version is kept for rollback"""
+        if not self.exists(version):
+            raise ValueError(f"Unknown model version {version!r}")
+        state = self.state()
+        if state["active"] not in (None, version):
+            state["history"].append(state["active"])
+        state["active"] = version
+        self.root.mkdir(parents=True, exist_ok=True)
+        _write_json_atomic(self.root / STATE_FILE, state)
+        return state
+
+    def rollback_target(self):
+        """Version a rollback would activate"""
+        history = self.state()["history"]
+        if not history:
+            raise ValueError("No previous model version to roll back to")
+        return history[-1]
+
+    def rollback(self):
+        """Re-activate the previously active version"""
+        state = self.state()
+        if not state["history"]:
+            raise ValueError("No previous model version to roll back to")
+        state["active"] = state["history"].pop()
+        _write_json_atomic(self.root / STATE_FILE, state)
+        return state
+
+
+class RegistryWatcher:
+    """Background thread that calls on_change(version) when the active version changes
+
+    on_change must only return once it has tried to load the version
+    (waiting for a reload that is already running rather than skipping
+    it): the version is marked as handled when on_change returns.
+
+    Each server process (including forked workers) runs its own watcher,
+    so activating a version from any worker or from the command line
+    reaches every process within `interval` seconds.
+    """
+
+    def __init__(self, registry, on_change, interval=5.0):
+        self.registry = registry
+        self.on_change = on_change
+        self.interval = interval
+        self.seen = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        # Threads don't survive fork, so each worker process starts its own
+        if self.interval <= 0 or (self._pid == os.getpid() and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="model-registry-watcher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                version = self.registry.active_version()
+            except (OSError, ValueError):
+                continue
+            if version is not None and version != self.seen:
+                # on_change returns once the version was loaded or failed to
+                # load; only then is it marked as handled
+                self.on_change(version)
+                self.seen = version
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Manage the versioned model registry")
+    parser.add_argument("--registry", default=os.environ.get("MODEL_REGISTRY", DEFAULT_REGISTRY),
+                        help="Registry directory (default: $MODEL_REGISTRY or model_registry)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    publish = commands.add_parser("publish", help="Copy a trained model into a new version")
+    publish.add_argument("model", nargs="?", default="cattle_buffalo_model", help="Model path prefix")
+    publish.add_argument("--version", default=None, help="Version name (default: next vN)")
+    publish.add_argument("--activate", action="store_true", help="Also make it the active version")
+
+    commands.add_parser("list", help="List versions")
+    activate = commands.add_parser("activate", help="Set the active version")
+    activate.add_argument("version")
+    commands.add_parser("rollback", help="Re-activate the previous version")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Publish, list, activate or roll back model versions"""
+    args = parse_args(argv)
+    registry = ModelRegistry(args.registry)
+
+    try:
+        if args.command == "publish":
+            version = registry.publish(args.model, args.version)
+            print(f"Published {args.model} as version {version} in {registry.root}")
+            if args.activate:
+                registry.activate(version)
+                print(f"Activated {version}")
+        elif args.command == "list":
+            versions = registry.versions()
+            if not versions:
+                print(f"No versions in {registry.root}")
+            for info in versions:
+                marker = "*" if info["active"] else " "
+                print(f"{marker} {info['version']:<12} {info['created']}  {info['model_type']:<26} "
+                      f"profile {info['feature_profile']}{'  cascade' if info['cascade'] else ''}")
+        elif args.command == "activate":
+            registry.activate(args.version)
+            print(f"Activated {args.version}; running servers switch within their reload interval")
+        elif args.command == "rollback":
+            state = registry.rollback()
+            print(f"Rolled back to {state['active']}")
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
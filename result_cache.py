@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Content-addressed Classification Result Cache
+In-process LRU cache (size and TTL bounded) with an optional on-disk store,
+keyed by a hash of the image bytes, bbox and model version
+"""
+
+from collections import OrderedDict
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    def __init__(self, max_entries=1024, ttl_seconds=3600, disk_dir=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self._entries = OrderedDict()  # key -> (expires_at, result)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(image_bytes, bbox, model_version):
+        """Hash of the encoded image bytes, the bbox and the model version"""
+        digest = hashlib.sha256()
+        digest.update(image_bytes)
+        digest.update(json.dumps(bbox).encode())
+        digest.update(str(model_version).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached result for key, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, result = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self._entries[key]
+
+        result = self._disk_get(key, now)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+        self._insert(key, result, now)
+        return result
+
+    def put(self, key, result):
+        """Store a (JSON serializable) result"""
+        now = time.time()
+        self._insert(key, result, now)
+        self._disk_put(key, result, now)
+
+    def clear(self):
+        """Drop every in-memory entry (e.g. when the model is reloaded)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'disk_store': str(self.disk_dir) if self.disk_dir else None
+            }
+
+    def _insert(self, key, result, now):
+        with self._lock:
+            self._entries[key] = (now + self.ttl_seconds, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _disk_path(self, key):
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def _disk_get(self, key, now):
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('created', 0) + self.ttl_seconds <= now:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            return None
+        return entry.get('result')
+
+    def _disk_put(self, key, result, now):
+        if self.disk_dir is None:
+            return
+        path = self._disk_path(key)
+        try:
+            path.parent.mkdir(exist_ok=True)
+            # Write to a temporary file and rename so readers never see partial JSON
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_path, 'w') as f:
+                json.dump({'created': now, 'result': result}, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not write result cache entry: {e}")
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Production Server for Cattle vs Buffalo Classification
+Pre-loads the model once, then forks worker processes that share it
+copy-on-write and serve the app.py routes from a shared listening socket
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("serve")
+
+# Environment variables read by the numeric libraries when they start their thread pools
+NATIVE_THREAD_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Production server for the classification API")
+    parser.add_argument("--host", default="0.0.0.0", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=5000, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (default: one per core)")
+    parser.add_argument("--threads", type=int, default=4,
+                        help="Request handler threads per worker")
+    parser.add_argument("--native-threads", type=int, default=1,
+                        help="OpenCV/BLAS threads per worker")
+    parser.add_argument("--backlog", type=int, default=128, help="Listen backlog")
+    parser.add_argument("--graceful-timeout", type=float, default=30.0,
+                        help="Seconds to let in-flight requests finish on shutdown")
+    return parser.parse_args(argv)
+
+
+def limit_native_threads(n_threads):
+    """Cap OpenCV and BLAS/OpenMP thread pools for this process"""
+    for var in NATIVE_THREAD_VARS:
+        os.environ[var] = str(n_threads)
+
+    import cv2
+    cv2.setNumThreads(n_threads)
+
+    # Pools that were already started ignore the environment variables
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(n_threads)
+    except ImportError:
+        pass
+
+
+def make_server_class():
+    """Build the thread-pool WSGI server class (werkzeug is imported lazily)"""
+    from werkzeug.serving import BaseWSGIServer
+
+    class PooledWSGIServer(BaseWSGIServer):
+        """WSGI server handling requests on a fixed-size thread pool"""
+
+        multithread = True
+
+        def __init__(self, *args, threads=4, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="request")
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._process_request, request, client_address)
+
+        def _process_request(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+        def drain(self):
+            """Stop accepting work and wait for in-flight requests"""
+            self.pool.shutdown(wait=True)
+
+    return PooledWSGIServer
+
+
+def run_worker(listen_socket, flask_app, args):
+    """Serve requests in this process until SIGTERM/SIGINT, then drain"""
+    limit_native_threads(args.native_threads)
+
+    server_class = make_server_class()
+    server = server_class(
+        args.host, args.port, flask_app, threads=args.threads, fd=listen_socket.fileno()
+    )
+
+    def stop(signum, frame):
+        # shutdown() blocks until serve_forever returns, so call it from another thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logger.info(f"Worker {os.getpid()} serving with {args.threads} threads")
+    server.serve_forever()
+    server.drain()
+    logger.info(f"Worker {os.getpid()} drained and stopped")
+
+
+def spawn_worker(listen_socket, flask_app, args):
+    """Fork one worker process; returns its pid in the master"""
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 0
+        try:
+            run_worker(listen_socket, flask_app, args)
+        except Exception as e:
+            logger.error(f"Worker {os.getpid()} crashed: {e}")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+    return pid
+
+
+def run_master(listen_socket, flask_app, args):
+    """Fork the workers, restart any that die, and shut down gracefully"""
+    workers = set()
+    stopping = threading.Event()
+
+    def request_stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    for _ in range(args.workers):
+        workers.add(spawn_worker(listen_socket, flask_app, args))
+    logger.info(f"Master {os.getpid()} started {args.workers} workers on {args.host}:{args.port}")
+
+    while not stopping.is_set():
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid and pid in workers:
+            workers.discard(pid)
+            if not stopping.is_set():
+                logger.warning(f"Worker {pid} exited (status {status}); restarting")
+                workers.add(spawn_worker(listen_socket, flask_app, args))
+        time.sleep(0.2)
+
+    # Graceful shutdown: workers stop accepting, finish in-flight requests, exit
+    logger.info("Shutting down: draining workers...")
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    deadline = time.monotonic() + args.graceful_timeout
+    while workers and time.monotonic() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            workers.discard(pid)
+        else:
+            time.sleep(0.1)
+
+    for pid in workers:
+        logger.warning(f"Worker {pid} did not drain in {args.graceful_timeout}s; killing")
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    listen_socket.close()
+    logger.info("Server stopped")
+
+
+def main(argv=None):
+    """Load the model once, bind the socket and start the workers"""
+    args = parse_args(argv)
+
+    # Must be set before numpy/OpenCV start their thread pools
+    limit_native_threads(args.native_threads)
+
+    import app as backend
+
+    if not backend.load_model():
+        logger.error("Failed to load model. Exiting.")
+        return 1
+
+    listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listen_socket.bind((args.host, args.port))
+    listen_socket.listen(args.backlog)
+    listen_socket.set_inheritable(True)
+
+    if not hasattr(os, "fork") or args.workers <= 1:
+        # Single process (also the only option on platforms without fork)
+        run_worker(listen_socket, backend.app, args)
+        listen_socket.close()
+        return 0
+
+    run_master(listen_socket, backend.app, args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
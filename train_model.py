@@ -8,24 +8,132 @@ import os
 import pandas as pd
 import numpy as np
 import cv2
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import LabelEncoder
+from sklearn.model_selection import train_test_split, GridSearchCV, ParameterGrid, StratifiedKFold
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+from sklearn.linear_model import SGDClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.svm import SVC
+from sklearn.svm import SVC, LinearSVC
+from sklearn.kernel_approximation import Nystroem
+from sklearn.calibration import CalibratedClassifierCV
 from sklearn.metrics import classification_report, confusion_matrix, accuracy_score
 import joblib
 import json
+import argparse
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
 import warnings
 warnings.filterwarnings('ignore')
 
+from features import (
+    extract_features, extract_features_batch, extract_crops_features, crop_and_resize, load_image,
+    profile_columns, profile_feature_names, CASCADE_PROFILE,
+    FEATURE_NAMES, FEATURE_EXTRACTOR_VERSION, FEATURE_PROFILES, STAGE_COLUMNS, N_FEATURES
+)
+from feature_store import FeatureStore
+from model_artifact import save_artifact, artifact_path, cascade_model_path, compile_model, ARTIFACT_SUFFIX
+from model_registry import ModelRegistry
+
+def extract_file_features(image_path, bbox=None, profile="full"):
+    """Load an image file and extract its features, or None on failure"""
+    try:
+        # Load image as RGB
+        image = load_image(image_path)
+        if image is None:
+            return None
+        
+        return extract_features(image, bbox, profile=profile)
+        
+    except Exception as e:
+        print(f"Error processing {image_path}: {e}")
+        return None
+
+def extract_file_crops(image_path, bboxes):
+    """Decode an image file once and extract the features of every bbox crop
+    
+    Returns an (n_bboxes, N_FEATURES) float32 matrix with NaN rows for
+    crops that failed (all rows if the image cannot be read).
+    """
+    try:
+        image = load_image(image_path)
+        if image is not None:
+            return extract_features_batch([image] * len(bboxes), bboxes)
+    except Exception as e:
+        print(f"Error processing {image_path}: {e}")
+    return np.full((len(bboxes), N_FEATURES), np.nan, dtype=np.float32)
+
+def extraction_cost_ms(crops, profile, repeats=3):
+    """Mean feature extraction ms per crop for a profile, and ms per crop of each stage"""
+    timings = {}
+    start = time.perf_counter()
+    for _ in range(repeats):
+        extract_crops_features(crops, timings, profile)
+    n = repeats * len(crops)
+    per_image = (time.perf_counter() - start) / n * 1000
+    return per_image, {stage: seconds / n * 1000 for stage, seconds in timings.items()}
+
+def calibrate_threshold(first_proba, second_pred, y, classes, max_accuracy_drop=0.005):
+    """Lowest first-stage confidence at which the cascade stays accurate enough
+    
+    Rows whose first-stage confidence is at or above the threshold take
+    the first stage's answer, the rest the second stage's. Returns the
+    lowest threshold whose cascade accuracy on y is within
+    max_accuracy_drop of the second stage alone, or None if no threshold
+    lets any row exit early.
+    """
+    confidence = first_proba.max(axis=1)
+    first_pred = np.asarray(classes)[np.argmax(first_proba, axis=1)]
+    target = np.mean(second_pred == y) - max_accuracy_drop
+    for threshold in np.unique(confidence):
+        cascade_pred = np.where(confidence >= threshold, first_pred, second_pred)
+        if np.mean(cascade_pred == y) >= target - 1e-12:
+            return float(threshold)
+    return None
+
+def serving_model(model):
+    """Drop n_jobs from a fitted model: single-row inference is faster without a thread pool"""
+    params = model.get_params()
+    n_jobs = {key: None for key in params if key == 'n_jobs' or key.endswith('__n_jobs')}
+    if n_jobs:
+        model.set_params(**n_jobs)
+    return model
+
+def measure_predict_latency(model, X, repeats=50):
+    """Median predict_proba latency in milliseconds, as served (forests compiled)"""
+    model = compile_model(model)
+    predict = model.predict_proba if hasattr(model, 'predict_proba') else model.predict
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predict(X)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings) * 1000)
+
+def _init_feature_worker():
+    """Limit OpenCV to one thread per worker so processes don't oversubscribe cores"""
+    cv2.setNumThreads(1)
+
+def _extract_chunk(chunk):
+    """Worker entry point: extract features for a list of (image_path, bboxes)"""
+    return [extract_file_crops(image_path, bboxes) for image_path, bboxes in chunk]
+
 class CattleBuffaloClassifier:
     def __init__(self, dataset_path="cow-and-buffalo.v1i.tensorflow"):
         self.dataset_path = Path(dataset_path)
         self.model = None
         self.label_encoder = LabelEncoder()
-        self.feature_names = []
+        self.feature_names = list(FEATURE_NAMES)
+        self.feature_profile = "full"
         self.class_mapping = {}
+        self.selection_report = None
+        self.profile_report = None
+        self.cascade_model = None
+        self.cascade_report = None
+        self.image_index = None
         
     def load_dataset(self):
         """Load and preprocess the dataset from CSV files"""
@@ -71,155 +179,248 @@ class CattleBuffaloClassifier:
     
     def extract_features(self, image_path, bbox=None):
         """Extract features from an image"""
-        try:
-            # Load image
-            image = cv2.imread(str(image_path))
-            if image is None:
-                return None
-                
-            # Convert to RGB
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            
-            # Crop to bounding box if provided
-            if bbox is not None:
-                xmin, ymin, xmax, ymax = bbox
-                image = image[ymin:ymax, xmin:xmax]
-            
-            # Resize image to standard size
-            image = cv2.resize(image, (224, 224))
-            
-            # Extract color features
-            features = []
-            
-            # 1. Color histogram features
-            for i in range(3):  # RGB channels
-                hist = cv2.calcHist([image], [i], None, [32], [0, 256])
-                features.extend(hist.flatten())
-            
-            # 2. HSV color features
-            hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
-            for i in range(3):  # HSV channels
-                hist = cv2.calcHist([hsv], [i], None, [32], [0, 256])
-                features.extend(hist.flatten())
-            
-            # 3. Texture features (LBP-like)
-            gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-            
-            # Local Binary Pattern approximation
-            lbp = self.compute_lbp(gray)
-            lbp_hist = cv2.calcHist([lbp], [0], None, [16], [0, 16])
-            features.extend(lbp_hist.flatten())
-            
-            # 4. Edge features
-            edges = cv2.Canny(gray, 50, 150)
-            edge_density = np.sum(edges > 0) / (edges.shape[0] * edges.shape[1])
-            features.append(edge_density)
-            
-            # 5. Brightness and contrast
-            brightness = np.mean(gray)
-            contrast = np.std(gray)
-            features.extend([brightness, contrast])
-            
-            # 6. Shape features
-            contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            if contours:
-                largest_contour = max(contours, key=cv2.contourArea)
-                area = cv2.contourArea(largest_contour)
-                perimeter = cv2.arcLength(largest_contour, True)
-                if perimeter > 0:
-                    circularity = 4 * np.pi * area / (perimeter * perimeter)
-                else:
-                    circularity = 0
-            else:
-                area = 0
-                circularity = 0
-            
-            features.extend([area, circularity])
-            
-            # 7. Color moments
-            for channel in range(3):
-                channel_data = image[:, :, channel].flatten()
-                mean = np.mean(channel_data)
-                std = np.std(channel_data)
-                skewness = self.compute_skewness(channel_data)
-                features.extend([mean, std, skewness])
-            
-            return np.array(features)
-            
-        except Exception as e:
-            print(f"Error processing {image_path}: {e}")
-            return None
+        return extract_file_features(image_path, bbox, self.feature_profile)
+    
+    def use_profile(self, profile):
+        """Train against a feature profile; returns its column indices in the full layout"""
+        columns = profile_columns(profile)
+        self.feature_profile = profile
+        self.feature_names = profile_feature_names(profile)
+        return columns
+    
+    def build_image_index(self):
+        """Map every image filename to its path with one directory scan per split
+        
+        Splits are scanned in train, valid, test order and the first match
+        wins, as with the per-row lookups this replaces.
+        """
+        index = {}
+        for split in ("train", "valid", "test"):
+            split_dir = self.dataset_path / split
+            if not split_dir.is_dir():
+                continue
+            with os.scandir(split_dir) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        index.setdefault(entry.name, split_dir / entry.name)
+        return index
+    
+    def resolve_image_path(self, filename):
+        """Find an image in the train/valid/test folders, or None"""
+        if self.image_index is None:
+            self.image_index = self.build_image_index()
+        return self.image_index.get(filename)
     
-    def compute_lbp(self, image, radius=1, n_points=8):
-        """Compute Local Binary Pattern"""
-        rows, cols = image.shape
-        lbp = np.zeros_like(image)
-        
-        for i in range(radius, rows - radius):
-            for j in range(radius, cols - radius):
-                center = image[i, j]
-                binary_string = ''
-                
-                for k in range(n_points):
-                    angle = 2 * np.pi * k / n_points
-                    x = int(i + radius * np.cos(angle))
-                    y = int(j + radius * np.sin(angle))
-                    
-                    if x < rows and y < cols:
-                        if image[x, y] >= center:
-                            binary_string += '1'
-                        else:
-                            binary_string += '0'
-                    else:
-                        binary_string += '0'
-                
-                lbp[i, j] = int(binary_string, 2)
-        
-        return lbp
-    
-    def compute_skewness(self, data):
-        """Compute skewness of data"""
-        mean = np.mean(data)
-        std = np.std(data)
-        if std == 0:
-            return 0
-        return np.mean(((data - mean) / std) ** 3)
-    
-    def prepare_features(self, df):
-        """Extract features from all images"""
+    def iter_image_groups(self, df):
+        """Yield (image_path, row positions, bboxes) once per image file
+        
+        Annotations are grouped by filename in order of first appearance;
+        row positions index into df so results can be put back in order.
+        """
+        bbox_values = df[['xmin', 'ymin', 'xmax', 'ymax']].to_numpy()
+        for filename, positions in df.groupby('filename', sort=False).indices.items():
+            image_path = self.resolve_image_path(filename)
+            if image_path is None:
+                print(f"Image not found: {filename}")
+                continue
+            yield image_path, positions, [list(bbox) for bbox in bbox_values[positions]]
+    
+    def prepare_features(self, df, n_workers=1, chunk_size=16, feature_store=None):
+        """Extract features from all images
+        
+        Each image file is decoded once and all of its annotated crops are
+        extracted from the in-memory image. With n_workers > 1 (or -1 for
+        all cores) images are extracted in chunks by a process pool. Rows
+        are written back in dataframe order, so X and y are identical to
+        the serial path. With a FeatureStore only annotations missing from
+        the store are extracted; the rest are read from its shards.
+        """
         print("Extracting features from images...")
         
-        features_list = []
-        labels_list = []
-        valid_indices = []
+        # Rows stay NaN if the image is missing or extraction fails
+        features = np.full((len(df), N_FEATURES), np.nan, dtype=np.float32)
+        self._fill_features(df, features, n_workers, chunk_size, feature_store)
         
-        for idx, row in df.iterrows():
-            if idx % 50 == 0:
-                print(f"Processing image {idx}/{len(df)}")
-            
-            # Construct image path
-            image_path = self.dataset_path / "train" / row['filename']
-            if not image_path.exists():
-                image_path = self.dataset_path / "valid" / row['filename']
-            if not image_path.exists():
-                image_path = self.dataset_path / "test" / row['filename']
+        valid = ~np.isnan(features).any(axis=1)
+        print(f"Successfully processed {int(valid.sum())} images")
+        
+        return features[valid], df['animal_type'].to_numpy()[valid]
+    
+    def prepare_features_memmap(self, df, matrix_path, n_workers=1, chunk_size=16,
+                                feature_store=None, chunk_rows=8192):
+        """Extract features into a memory-mapped .npy matrix on disk
+        
+        Rows are written as images are extracted, so memory use does not
+        grow with the dataset. Returns (features memmap with one row per
+        annotation, labels, valid row mask); failed rows are NaN.
+        """
+        print(f"Extracting features into memory-mapped matrix {matrix_path}...")
+        
+        features = np.lib.format.open_memmap(
+            matrix_path, mode='w+', dtype=np.float32, shape=(len(df), N_FEATURES)
+        )
+        for start in range(0, len(df), chunk_rows):
+            features[start:start + chunk_rows] = np.nan
+        self._fill_features(df, features, n_workers, chunk_size, feature_store)
+        features.flush()
+        
+        valid = np.zeros(len(df), dtype=bool)
+        for start in range(0, len(df), chunk_rows):
+            valid[start:start + chunk_rows] = ~np.isnan(features[start:start + chunk_rows]).any(axis=1)
+        print(f"Successfully processed {int(valid.sum())} images")
+        
+        return features, df['animal_type'].to_numpy(), valid
+    
+    def _fill_features(self, df, features, n_workers, chunk_size, feature_store):
+        """Write the features of every annotation row of df into features
+        
+        Image groups are streamed from iter_image_groups, so the groups of
+        the whole dataset are never held at once.
+        """
+        groups = self.iter_image_groups(df)
+        n_groups = df['filename'].nunique()
+        
+        if feature_store is not None:
+            self._extract_with_store(groups, n_groups, features, feature_store, n_workers, chunk_size)
+        else:
+            for (_, positions, _), group_features in self._extract_groups(
+                groups, n_groups, n_workers, chunk_size
+            ):
+                features[positions] = group_features
+    
+    def _extract_groups(self, groups, n_groups, n_workers=1, chunk_size=16):
+        """Yield (group, its (n_bboxes, N_FEATURES) matrix) for each image group, in order
+        
+        groups is an iterable of (image_path, _, bboxes) tuples and is
+        consumed once; n_groups is its length, used for progress output.
+        """
+        if n_workers == -1:
+            n_workers = os.cpu_count() or 1
+        
+        if n_workers > 1 and n_groups > chunk_size:
+            yield from self._extract_parallel(groups, n_groups, n_workers, chunk_size)
+            return
+        
+        for i, group in enumerate(groups):
+            if i % 50 == 0:
+                print(f"Processing image {i}/{n_groups}")
+            image_path, _, bboxes = group
+            yield group, extract_file_crops(image_path, bboxes)
+    
+    def _extract_with_store(self, groups, n_groups, features, feature_store, n_workers, chunk_size,
+                            shard_rows=8192):
+        """Fill features from the feature store and extract only missing annotations
+        
+        Image groups are processed in blocks of about shard_rows
+        annotations: the block's keys are looked up in the store, its
+        missing annotations are extracted and added as one shard, and its
+        rows are copied into features. Memory use is bounded by the block
+        size, whatever the dataset size.
+        """
+        groups = iter(groups)
+        n_cached = n_extracted = 0
+        while True:
+            block, n_rows = [], 0
+            for image_path, positions, bboxes in groups:
+                keys = [feature_store.make_key(image_path, bbox) for bbox in bboxes]
+                block.append((image_path, positions, bboxes, keys))
+                n_rows += len(keys)
+                if n_rows >= shard_rows:
+                    break
+            if not block:
+                break
             
-            if not image_path.exists():
-                print(f"Image not found: {row['filename']}")
-                continue
+            rows = feature_store.get_many(key for *_, keys in block for key in keys)
+            # Deduplicate so an annotation listed twice is only extracted once
+            missing_groups, pending = [], set()
+            for image_path, _, bboxes, keys in block:
+                missing_keys, missing_bboxes = [], []
+                for key, bbox in zip(keys, bboxes):
+                    if key not in rows and key not in pending:
+                        pending.add(key)
+                        missing_keys.append(key)
+                        missing_bboxes.append(bbox)
+                if missing_keys:
+                    missing_groups.append((image_path, missing_keys, missing_bboxes))
+            n_cached += n_rows - len(pending)
+            n_extracted += len(pending)
+            print(f"Feature store: {n_cached} cached, {n_extracted} extracted so far")
             
-            # Extract features
-            bbox = [row['xmin'], row['ymin'], row['xmax'], row['ymax']]
-            features = self.extract_features(image_path, bbox)
+            if missing_groups:
+                new_keys, new_rows = [], []
+                for (_, keys, _), group_features in self._extract_groups(
+                    missing_groups, len(missing_groups), n_workers, chunk_size
+                ):
+                    new_keys.extend(keys)
+                    new_rows.extend(group_features)
+                feature_store.add(new_keys, new_rows)
+                rows.update(zip(new_keys, new_rows))
+            else:
+                feature_store.save()
             
-            if features is not None:
-                features_list.append(features)
-                labels_list.append(row['animal_type'])
-                valid_indices.append(idx)
+            for _, positions, _, keys in block:
+                for position, key in zip(positions, keys):
+                    row = rows[key]
+                    if row is not None:
+                        features[position] = row
+    
+    def _extract_parallel(self, groups, n_groups, n_workers, chunk_size):
+        """Yield (group, features) computed by a process pool, in order
         
-        print(f"Successfully processed {len(features_list)} images")
+        At most two chunks per worker are in flight, so groups are read
+        from the iterable only as fast as the pool extracts them.
+        """
+        n_chunks = -(-n_groups // chunk_size)
+        print(f"Using {n_workers} worker processes ({n_chunks} chunks of {chunk_size} images)")
         
-        return np.array(features_list), np.array(labels_list)
+        groups = iter(groups)
+        in_flight = deque()
+        done = 0
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_feature_worker) as executor:
+            while True:
+                while len(in_flight) < 2 * n_workers:
+                    chunk = list(islice(groups, chunk_size))
+                    if not chunk:
+                        break
+                    tasks = [(image_path, bboxes) for image_path, _, bboxes in chunk]
+                    in_flight.append((chunk, executor.submit(_extract_chunk, tasks)))
+                if not in_flight:
+                    break
+                # Results are yielded in submission order
+                chunk, future = in_flight.popleft()
+                yield from zip(chunk, future.result())
+                done += len(chunk)
+                print(f"Processed image {done}/{n_groups}")
+    
+    def candidate_models(self):
+        """Candidate estimators and their hyperparameter grids for model selection
+        
+        Every candidate exposes predict_proba, which the API needs. The SVMs
+        get probabilities from sigmoid (Platt) calibration on cross-validated
+        decision values, refit as a single model (ensemble=False).
+        'Nystroem SVM' approximates the RBF kernel with n_components
+        landmark features and a linear SVM, so its prediction cost is fixed
+        by n_components instead of growing with the number of support
+        vectors (and the fit scales linearly with the training set).
+        """
+        return {
+            'Random Forest': (
+                RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1),
+                {'n_estimators': [100, 200], 'max_depth': [None, 20], 'min_samples_leaf': [1, 2]}
+            ),
+            'SVM': (
+                CalibratedClassifierCV(SVC(kernel='rbf', random_state=42), ensemble=False),
+                {'estimator__C': [1, 10, 100], 'estimator__gamma': ['scale']}
+            ),
+            'Nystroem SVM': (
+                Pipeline([
+                    ('scaler', StandardScaler()),
+                    ('kernel_map', Nystroem(kernel='rbf', n_components=300, random_state=42)),
+                    ('svm', CalibratedClassifierCV(LinearSVC(random_state=42), ensemble=False))
+                ]),
+                {'kernel_map__n_components': [100, 300], 'svm__estimator__C': [0.1, 1, 10]}
+            )
+        }
     
     def train_model(self, X, y):
         """Train the classification model"""
@@ -231,10 +432,7 @@ class CattleBuffaloClassifier:
         )
         
         # Try multiple models
-        models = {
-            'Random Forest': RandomForestClassifier(n_estimators=100, random_state=42),
-            'SVM': SVC(kernel='rbf', random_state=42)
-        }
+        models = {name: model for name, (model, _) in self.candidate_models().items()}
         
         best_model = None
         best_score = 0
@@ -259,24 +457,334 @@ class CattleBuffaloClassifier:
         
         print(f"\nBest model: {best_name} with accuracy {best_score:.4f}")
         
+        self.model = serving_model(best_model)
+        return best_model, best_score
+    
+    def select_model(self, X, y, cv=5, n_jobs=-1):
+        """Cross-validated model and hyperparameter selection using all cores
+        
+        Every candidate grid is evaluated with stratified k-fold CV on the
+        80% training split (folds and grid points run in parallel). The
+        best configuration is refit and scored on the 20% hold-out split.
+        A timing table (fit time, predict latency, CV accuracy) is printed
+        and stored in the model metadata.
+        """
+        print(f"Selecting model with {cv}-fold cross-validation (n_jobs={n_jobs})...")
+        
+        X_train, X_test, y_train, y_test = train_test_split(
+            X, y, test_size=0.2, random_state=42, stratify=y
+        )
+        folds = StratifiedKFold(n_splits=cv, shuffle=True, random_state=42)
+        validation_rows = len(X_train) / cv
+        
+        rows = []
+        best_search = None
+        best_name = ""
+        
+        for name, (model, param_grid) in self.candidate_models().items():
+            print(f"Cross-validating {name} ({len(ParameterGrid(param_grid))} configurations)...")
+            search = GridSearchCV(
+                model, param_grid, cv=folds, scoring='accuracy', n_jobs=n_jobs, refit=True
+            )
+            start = time.perf_counter()
+            search.fit(X_train, y_train)
+            elapsed = time.perf_counter() - start
+            print(f"{name}: best CV accuracy {search.best_score_:.4f} in {elapsed:.1f}s")
+            
+            results = search.cv_results_
+            for i, params in enumerate(results['params']):
+                rows.append({
+                    'model': name,
+                    'params': params,
+                    'fit_time_s': float(results['mean_fit_time'][i]),
+                    'predict_ms_per_row': float(results['mean_score_time'][i]) / validation_rows * 1000,
+                    'cv_accuracy': float(results['mean_test_score'][i]),
+                    'cv_accuracy_std': float(results['std_test_score'][i])
+                })
+            
+            if best_search is None or search.best_score_ > best_search.best_score_:
+                best_search = search
+                best_name = name
+        
+        self.print_timing_table(rows)
+        
+        best_model = serving_model(best_search.best_estimator_)
+        single_row_ms = measure_predict_latency(best_model, X_test[:1])
+        y_pred = best_model.predict(X_test)
+        best_score = accuracy_score(y_test, y_pred)
+        
+        print(f"\nBest model: {best_name} {best_search.best_params_}")
+        print(f"CV accuracy {best_search.best_score_:.4f}, hold-out accuracy {best_score:.4f}, "
+              f"single-row predict_proba {single_row_ms:.2f} ms")
+        print(classification_report(y_test, y_pred))
+        
         self.model = best_model
+        self.selection_report = {
+            'cv_folds': cv,
+            'best_model': best_name,
+            'best_params': best_search.best_params_,
+            'cv_accuracy': float(best_search.best_score_),
+            'holdout_accuracy': float(best_score),
+            'single_row_predict_ms': single_row_ms,
+            'candidates': rows
+        }
         return best_model, best_score
     
-    def save_model(self, model_path="cattle_buffalo_model"):
-        """Save the trained model and metadata"""
+    def train_incremental(self, X, y, valid, chunk_rows=8192, epochs=5, columns=None):
+        """Train a linear model chunk by chunk with partial_fit
+        
+        X may be a memory-mapped matrix larger than RAM: only chunk_rows rows
+        are read at a time. A StandardScaler is fitted in a first pass, then
+        an SGDClassifier with logistic loss (so predict_proba is available)
+        runs several epochs over shuffled chunks of the 80% training split.
+        columns optionally selects the feature profile's columns of X.
+        """
+        print(f"Training incrementally ({epochs} epochs, chunks of {chunk_rows} rows)...")
+        
+        rows = np.flatnonzero(valid)
+        train_rows, test_rows = train_test_split(
+            rows, test_size=0.2, random_state=42, stratify=y[rows]
+        )
+        classes = np.unique(y[rows])
+        rng = np.random.default_rng(42)
+        
+        def chunks(row_indices):
+            # Sorted indices turn each chunk into mostly sequential reads
+            for start in range(0, len(row_indices), chunk_rows):
+                chunk = np.sort(row_indices[start:start + chunk_rows])
+                X_chunk = np.asarray(X[chunk])
+                yield (X_chunk if columns is None else X_chunk[:, columns]), y[chunk]
+        
+        scaler = StandardScaler()
+        for X_chunk, _ in chunks(train_rows):
+            scaler.partial_fit(X_chunk)
+        
+        sgd = SGDClassifier(loss='log_loss', alpha=1e-4, random_state=42)
+        for epoch in range(epochs):
+            start = time.perf_counter()
+            for X_chunk, y_chunk in chunks(rng.permutation(train_rows)):
+                sgd.partial_fit(scaler.transform(X_chunk), y_chunk, classes=classes)
+            print(f"Epoch {epoch + 1}/{epochs} in {time.perf_counter() - start:.1f}s")
+        
+        model = Pipeline([('scaler', scaler), ('classifier', sgd)])
+        
+        # Evaluate on the hold-out split chunk by chunk
+        y_test, y_pred = [], []
+        for X_chunk, y_chunk in chunks(test_rows):
+            y_test.append(y_chunk)
+            y_pred.append(model.predict(X_chunk))
+        y_test, y_pred = np.concatenate(y_test), np.concatenate(y_pred)
+        score = accuracy_score(y_test, y_pred)
+        
+        print(f"Incremental SGD Accuracy: {score:.4f}")
+        print(classification_report(y_test, y_pred))
+        
+        self.model = model
+        return model, score
+    
+    def sample_crops(self, df, n_crops=32):
+        """224x224 crops of the first n_crops annotations, for cost measurements"""
+        crops = []
+        for image_path, _, bboxes in self.iter_image_groups(df):
+            image = load_image(image_path)
+            if image is not None:
+                crops.extend(crop_and_resize(image, bbox) for bbox in bboxes)
+            if len(crops) >= n_crops:
+                break
+        return np.stack(crops[:n_crops])
+    
+    def report_profiles(self, X, y, df, sample_images=32, repeats=3):
+        """Compare feature profiles by hold-out accuracy and extraction cost
+        
+        X holds full-profile features. Per-stage cost is measured on crops
+        of the first sample_images annotations; importances come from a
+        random forest on all features, summed per stage. Stages computed in
+        the shared colour-conversion and statistics passes have no cost of
+        their own; those passes are reported under 'shared_stages'.
+        """
+        print("Comparing feature profiles...")
+        
+        crops = self.sample_crops(df, sample_images)
+        
+        X_train, X_test, y_train, y_test = train_test_split(
+            X, y, test_size=0.2, random_state=42, stratify=y
+        )
+        forest = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1)
+        forest.fit(X_train, y_train)
+        _, stage_costs = extraction_cost_ms(crops, "full", repeats)
+        # Colour conversion and the fused statistics pass (histograms,
+        # brightness/contrast, moments) serve several stages at once, so
+        # they are reported as shared rows instead of being split per stage
+        shared = {stage: stage_costs.get(stage, 0.0) for stage in ('color_convert', 'statistics')}
+        
+        stages = []
+        print(f"\n{'Stage':<22} {'Columns':>8} {'Importance':>11} {'ms/image':>9}")
+        print("-" * 53)
+        for stage, columns in STAGE_COLUMNS.items():
+            importance = float(forest.feature_importances_[columns].sum())
+            cost = stage_costs.get(stage)
+            stages.append({
+                'stage': stage,
+                'columns': len(columns),
+                'importance': importance,
+                'ms_per_image': cost
+            })
+            cost_text = f"{cost:>9.3f}" if cost is not None else f"{'shared':>9}"
+            print(f"{stage:<22} {len(columns):>8} {importance:>11.3f} {cost_text}")
+        for stage, cost in shared.items():
+            print(f"{stage + ' (shared)':<22} {'':>8} {'':>11} {cost:>9.3f}")
+        
+        profiles = []
+        print(f"\n{'Profile':<10} {'Features':>9} {'Accuracy':>9} {'ms/image':>9}")
+        print("-" * 40)
+        for profile in FEATURE_PROFILES:
+            columns = profile_columns(profile)
+            model = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1)
+            model.fit(X_train[:, columns], y_train)
+            accuracy = accuracy_score(y_test, model.predict(X_test[:, columns]))
+            per_image, _ = extraction_cost_ms(crops, profile, repeats)
+            profiles.append({
+                'profile': profile,
+                'n_features': len(columns),
+                'holdout_accuracy': float(accuracy),
+                'ms_per_image': per_image
+            })
+            print(f"{profile:<10} {len(columns):>9} {accuracy:>9.4f} {per_image:>9.3f}")
+        
+        self.profile_report = {
+            'stages': stages, 'shared_stages': shared, 'profiles': profiles, 'sample_images': len(crops)
+        }
+        return self.profile_report
+    
+    def train_cascade(self, X, y, df, max_accuracy_drop=0.005, sample_images=32):
+        """Train the colour-histogram first stage of a two-stage cascade
+        
+        X holds full-layout features and self.model must already be trained
+        on the same 80% split. The first stage is fitted on part of that
+        split and its threshold calibrated on the rest (validation rows
+        neither stage was fitted on); that same first stage is the one
+        saved. On the 20% hold-out the early-exit fraction and the mean
+        latency (extraction + predict) are measured, and the cascade is
+        only kept if its mean latency is below the full model's.
+        """
+        print(f"Training cascade first stage ({CASCADE_PROFILE} profile)...")
+        first_columns = profile_columns(CASCADE_PROFILE)
+        second_columns = profile_columns(self.feature_profile)
+        
+        X_train, X_test, y_train, y_test = train_test_split(
+            X, y, test_size=0.2, random_state=42, stratify=y
+        )
+        X_fit, X_val, y_fit, y_val = train_test_split(
+            X_train, y_train, test_size=0.25, random_state=42, stratify=y_train
+        )
+        
+        # Calibrate on validation rows: fit both stages on the rest of the training split.
+        # The first stage is not refitted afterwards, so the threshold belongs to it
+        first = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1)
+        second = clone(self.model)
+        first.fit(X_fit[:, first_columns], y_fit)
+        second.fit(X_fit[:, second_columns], y_fit)
+        threshold = calibrate_threshold(
+            first.predict_proba(X_val[:, first_columns]), second.predict(X_val[:, second_columns]),
+            y_val, first.classes_, max_accuracy_drop
+        )
+        if threshold is None:
+            print("Cascade disabled: the first stage is never confident enough")
+            return None
+        
+        first = serving_model(first)
+        
+        # Evaluate the final cascade on the hold-out split
+        first_proba = first.predict_proba(X_test[:, first_columns])
+        exits = first_proba.max(axis=1) >= threshold
+        second_pred = self.model.predict(X_test[:, second_columns])
+        cascade_pred = np.where(exits, first.classes_[np.argmax(first_proba, axis=1)], second_pred)
+        early_exit = float(exits.mean())
+        
+        crops = self.sample_crops(df, sample_images)
+        first_ms = (extraction_cost_ms(crops, CASCADE_PROFILE)[0]
+                    + measure_predict_latency(first, X_test[:1, first_columns]))
+        second_ms = (extraction_cost_ms(crops, self.feature_profile)[0]
+                     + measure_predict_latency(self.model, X_test[:1, second_columns]))
+        mean_ms = first_ms + (1 - early_exit) * second_ms
+        
+        print(f"Threshold {threshold:.3f}: {early_exit:.1%} of hold-out images exit after the first stage")
+        print(f"Accuracy: cascade {accuracy_score(y_test, cascade_pred):.4f}, "
+              f"full model {accuracy_score(y_test, second_pred):.4f}")
+        print(f"Mean latency: cascade {mean_ms:.2f} ms vs full model {second_ms:.2f} ms per image")
+        if mean_ms >= second_ms:
+            print("Cascade disabled: it does not reduce mean latency")
+            return None
+        
+        self.cascade_model = first
+        self.cascade_report = {
+            'profile': CASCADE_PROFILE,
+            'threshold': threshold,
+            'max_accuracy_drop': max_accuracy_drop,
+            'early_exit_fraction': early_exit,
+            'cascade_accuracy': float(accuracy_score(y_test, cascade_pred)),
+            'full_accuracy': float(accuracy_score(y_test, second_pred)),
+            'first_stage_ms': first_ms,
+            'full_ms': second_ms,
+            'mean_latency_ms': mean_ms
+        }
+        return self.cascade_report
+    
+    def print_timing_table(self, rows):
+        """Print fit time, predict latency and CV accuracy per candidate"""
+        print(f"\n{'Model':<16} {'Params':<52} {'Fit (s)':>8} {'ms/row':>8} {'CV acc':>15}")
+        print("-" * 103)
+        for row in sorted(rows, key=lambda r: -r['cv_accuracy']):
+            params = ", ".join(f"{k}={v}" for k, v in row['params'].items())
+            print(f"{row['model']:<16} {params:<52} {row['fit_time_s']:>8.3f} "
+                  f"{row['predict_ms_per_row']:>8.4f} "
+                  f"{row['cv_accuracy']:>8.4f}±{row['cv_accuracy_std']:.4f}")
+    
+    def save_model(self, model_path="cattle_buffalo_model", artifact_format="joblib"):
+        """Save the trained model and metadata
+        
+        artifact_format="mmap" additionally writes {model_path}.mmap/, a
+        directory of raw arrays that the server opens memory-mapped.
+        """
         if self.model is None:
             print("No model to save!")
             return
         
-        # Save model
+        # Save model; artifacts lists the files written (as suffixes of
+        # model_path) so the registry never publishes leftovers of older runs
         joblib.dump(self.model, f"{model_path}.joblib")
+        artifacts = [".joblib"]
+        if artifact_format == "mmap":
+            manifest = save_artifact(self.model, artifact_path(model_path))
+            artifacts.append(ARTIFACT_SUFFIX)
+            print(f"Memory-mapped artifact ({manifest['kind']}) saved to {artifact_path(model_path)}")
+        
+        # First stage of the cascade, saved next to the main model
+        if self.cascade_model is not None:
+            first_stage_path = cascade_model_path(model_path)
+            stage = cascade_model_path("")
+            joblib.dump(self.cascade_model, f"{first_stage_path}.joblib")
+            artifacts.append(f"{stage}.joblib")
+            if artifact_format == "mmap":
+                save_artifact(self.cascade_model, artifact_path(first_stage_path))
+                artifacts.append(f"{stage}{ARTIFACT_SUFFIX}")
+            print(f"Cascade first stage saved to {first_stage_path}.joblib")
         
         # Save metadata
         metadata = {
             'class_mapping': self.class_mapping,
             'feature_names': self.feature_names,
-            'model_type': type(self.model).__name__
+            'model_type': type(self.model).__name__,
+            'feature_extractor_version': FEATURE_EXTRACTOR_VERSION,
+            'feature_profile': self.feature_profile,
+            'artifacts': artifacts
         }
+        if self.selection_report is not None:
+            metadata['model_selection'] = self.selection_report
+        if self.profile_report is not None:
+            metadata['profile_report'] = self.profile_report
+        if self.cascade_report is not None:
+            metadata['cascade'] = self.cascade_report
         
         with open(f"{model_path}_metadata.json", 'w') as f:
             json.dump(metadata, f, indent=2)
@@ -306,29 +814,118 @@ class CattleBuffaloClassifier:
             'probabilities': dict(zip(self.model.classes_, probabilities))
         }
 
-def main():
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Train the Cattle vs Buffalo classifier")
+    parser.add_argument("--dataset", default="cow-and-buffalo.v1i.tensorflow",
+                        help="Path to the Roboflow dataset folder")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Feature extraction processes (-1 for all cores)")
+    parser.add_argument("--chunk-size", type=int, default=16,
+                        help="Images per work item in parallel extraction")
+    parser.add_argument("--feature-store", default=None,
+                        help="Directory for cached features; only new annotations are extracted")
+    parser.add_argument("--cv", type=int, default=0,
+                        help="Select the model by k-fold cross-validated grid search (0 = single split)")
+    parser.add_argument("--jobs", type=int, default=-1,
+                        help="Parallel jobs for cross-validation (-1 for all cores)")
+    parser.add_argument("--out-of-core", action="store_true",
+                        help="Stream features to a memory-mapped matrix and train with partial_fit")
+    parser.add_argument("--matrix-path", default="features_matrix.npy",
+                        help="Memory-mapped feature matrix written in --out-of-core mode")
+    parser.add_argument("--chunk-rows", type=int, default=8192,
+                        help="Rows read per partial_fit step in --out-of-core mode")
+    parser.add_argument("--epochs", type=int, default=5,
+                        help="Passes over the training rows in --out-of-core mode")
+    parser.add_argument("--feature-profile", choices=list(FEATURE_PROFILES), default="full",
+                        help="Feature stages the model is trained on (served from the metadata)")
+    parser.add_argument("--profile-report", action="store_true",
+                        help="Report accuracy, importances and cost of every feature profile")
+    parser.add_argument("--cascade", action="store_true",
+                        help="Also train a colour-histogram first stage that answers confident images early")
+    parser.add_argument("--cascade-max-drop", type=float, default=0.005,
+                        help="Accuracy the cascade may lose vs the full model on validation data")
+    parser.add_argument("--artifact-format", choices=["joblib", "mmap"], default="joblib",
+                        help="Also write a memory-mapped model artifact for the server")
+    parser.add_argument("--registry", default=None,
+                        help="Publish the saved model as a new version in this model registry directory")
+    return parser.parse_args(argv)
+
+def publish_to_registry(registry_dir, model_path="cattle_buffalo_model"):
+    """Copy the saved model into the registry as a new (inactive) version"""
+    registry = ModelRegistry(registry_dir)
+    version = registry.publish(model_path)
+    print(f"Published as version {version} in {registry.root}")
+    print(f"Activate with: python model_registry.py --registry {registry.root} activate {version}")
+    return version
+
+def main(argv=None):
     """Main training function"""
+    args = parse_args(argv)
+    
     print("Cattle vs Buffalo Classification Model Training")
     print("=" * 50)
     
     # Initialize classifier
-    classifier = CattleBuffaloClassifier()
+    classifier = CattleBuffaloClassifier(args.dataset)
     
     # Load dataset
     df = classifier.load_dataset()
     
-    # Prepare features
-    X, y = classifier.prepare_features(df)
+    # Prepare features (always the full layout, so the feature store serves every profile)
+    feature_store = FeatureStore(args.feature_store) if args.feature_store else None
+    columns = classifier.use_profile(args.feature_profile)
+    
+    if args.out_of_core:
+        X, y, valid = classifier.prepare_features_memmap(
+            df, args.matrix_path, n_workers=args.workers, chunk_size=args.chunk_size,
+            feature_store=feature_store, chunk_rows=args.chunk_rows
+        )
+        if not valid.any():
+            print("No valid images found!")
+            return
+        if args.cascade:
+            print("--cascade is not supported with --out-of-core; training a single stage")
+        model, accuracy = classifier.train_incremental(
+            X, y, valid, chunk_rows=args.chunk_rows, epochs=args.epochs,
+            columns=None if args.feature_profile == "full" else columns
+        )
+        classifier.save_model(artifact_format=args.artifact_format)
+        if args.registry:
+            publish_to_registry(args.registry)
+        print("\nTraining completed!")
+        print(f"Final accuracy: {accuracy:.4f}")
+        return
+    
+    X, y = classifier.prepare_features(
+        df, n_workers=args.workers, chunk_size=args.chunk_size, feature_store=feature_store
+    )
     
     if len(X) == 0:
         print("No valid images found!")
         return
     
+    if args.profile_report:
+        classifier.report_profiles(X, y, df)
+    
+    X_full = X
+    if args.feature_profile != "full":
+        print(f"Training on the '{args.feature_profile}' feature profile ({len(columns)} features)")
+        X = X[:, columns]
+    
     # Train model
-    model, accuracy = classifier.train_model(X, y)
+    if args.cv:
+        model, accuracy = classifier.select_model(X, y, cv=args.cv, n_jobs=args.jobs)
+    else:
+        model, accuracy = classifier.train_model(X, y)
+    
+    if args.cascade:
+        classifier.train_cascade(X_full, y, df, max_accuracy_drop=args.cascade_max_drop)
     
     # Save model
-    classifier.save_model()
+    classifier.save_model(artifact_format=args.artifact_format)
+    if args.registry:
+        publish_to_registry(args.registry)
     
     print(f"\nTraining completed!")
     print(f"Final accuracy: {accuracy:.4f}")
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Video Classification for Cattle vs Buffalo
+Samples frames from a video file, classifies them in batches with the
+image model and smooths the per-frame predictions over time
+"""
+
+import argparse
+import json
+import sys
+import time
+import cv2
+import numpy as np
+
+from features import crop_and_resize, extract_crops_features, profile_columns, DEFAULT_PROFILE, IMAGE_SIZE
+from model_artifact import load_model_file, load_metadata
+
+# Upper bound on frames per model call; sampled frames are cropped to
+# 224x224 as they are read, so a batch holds at most this many crops
+MAX_BATCH_SIZE = 64
+
+
+class FrameSampler:
+    """Iterates (frame index, timestamp in seconds, RGB frame) for every stride-th frame
+
+    Skipped frames are only grabbed, not converted to BGR arrays.
+    frames_read counts every frame read from the video, sampled or not.
+    """
+
+    def __init__(self, video_path, stride=1):
+        self.video_path = video_path
+        self.stride = stride
+        self.frames_read = 0
+
+    def __iter__(self):
+        capture = cv2.VideoCapture(str(self.video_path))
+        if not capture.isOpened():
+            raise ValueError(f"Cannot open video: {self.video_path}")
+        fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+        self.frames_read = 0
+        try:
+            while True:
+                index = self.frames_read
+                if index % self.stride == 0:
+                    ok, frame = capture.read()
+                    if not ok:
+                        break
+                    self.frames_read += 1
+                    timestamp = index / fps if fps else capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                    yield index, timestamp, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                elif capture.grab():
+                    self.frames_read += 1
+                else:
+                    break
+        finally:
+            capture.release()
+
+
+def video_info(video_path):
+    """Frame rate, frame count and size reported by the container"""
+    capture = cv2.VideoCapture(str(video_path))
+    if not capture.isOpened():
+        raise ValueError(f"Cannot open video: {video_path}")
+    info = {
+        'fps': capture.get(cv2.CAP_PROP_FPS) or 0.0,
+        'frame_count': int(capture.get(cv2.CAP_PROP_FRAME_COUNT)),
+        'width': int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        'height': int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    }
+    capture.release()
+    return info
+
+
+def smooth_probabilities(probabilities, alpha):
+    """Exponential moving average over frames (alpha=1 disables smoothing)"""
+    smoothed = np.empty_like(probabilities)
+    state = None
+    for i, row in enumerate(probabilities):
+        state = row if state is None else alpha * row + (1 - alpha) * state
+        smoothed[i] = state
+    return smoothed
+
+
+def classify_video(model, video_path, stride=5, batch_size=32, alpha=0.3, bbox=None,
+                   profile=DEFAULT_PROFILE):
+    """Classify sampled frames of a video file in batches
+
+    Each sampled frame is cropped and resized to 224x224 straight away,
+    so memory is bounded by batch_size (capped at MAX_BATCH_SIZE) crops
+    regardless of the video resolution. Returns a dict with per-frame raw and smoothed predictions, the
+    overall prediction (class with the highest mean smoothed probability)
+    and throughput: decoded frames per second and the real-time factor
+    (video duration / processing time, > 1 is faster than real time).
+    """
+    info = video_info(video_path)
+    class_names = np.asarray(model.classes_)
+    batch_size = min(max(int(batch_size), 1), MAX_BATCH_SIZE)
+    start = time.perf_counter()
+
+    indices, timestamps, rows = [], [], []
+    failed = 0
+    sampler = FrameSampler(video_path, stride)
+    crops = np.empty((batch_size, IMAGE_SIZE, IMAGE_SIZE, 3), dtype=np.uint8)
+    features = np.empty((batch_size, len(profile_columns(profile))), dtype=np.float32)
+    batch_meta = []
+
+    def flush():
+        nonlocal failed
+        n = len(batch_meta)
+        extract_crops_features(crops[:n], profile=profile, out=features[:n])
+        valid = np.array([ok for _, _, ok in batch_meta]) & ~np.isnan(features[:n]).any(axis=1)
+        failed += int((~valid).sum())
+        if valid.any():
+            rows.append(model.predict_proba(features[:n][valid]))
+            for (index, timestamp, _), ok in zip(batch_meta, valid):
+                if ok:
+                    indices.append(index)
+                    timestamps.append(timestamp)
+        batch_meta.clear()
+
+    for index, timestamp, frame in sampler:
+        slot = crops[len(batch_meta)]
+        try:
+            crop_and_resize(frame, bbox, out=slot)
+            ok = True
+        except (cv2.error, ValueError):
+            slot[...] = 0
+            ok = False
+        batch_meta.append((index, timestamp, ok))
+        if len(batch_meta) >= batch_size:
+            flush()
+    if batch_meta:
+        flush()
+    elapsed = time.perf_counter() - start
+
+    sampled = len(indices) + failed
+    frames_read = sampler.frames_read
+    duration = frames_read / info['fps'] if info['fps'] else 0.0
+    result = {
+        'video': info,
+        'stride': stride,
+        'batch_size': batch_size,
+        'smoothing_alpha': alpha,
+        'frames_read': frames_read,
+        'frames_classified': len(indices),
+        'frames_failed': failed,
+        'processing_seconds': elapsed,
+        'decoded_fps': frames_read / elapsed if elapsed else 0.0,
+        'classified_fps': sampled / elapsed if elapsed else 0.0,
+        'realtime_factor': duration / elapsed if elapsed else 0.0,
+        'frames': []
+    }
+    if not indices:
+        result['prediction'] = None
+        return result
+
+    probabilities = np.vstack(rows)
+    smoothed = smooth_probabilities(probabilities, alpha)
+    for index, timestamp, raw, smooth in zip(indices, timestamps, probabilities, smoothed):
+        result['frames'].append({
+            'frame': int(index),
+            'time': round(float(timestamp), 3),
+            'prediction': str(class_names[np.argmax(raw)]),
+            'confidence': float(raw.max()),
+            'smoothed_prediction': str(class_names[np.argmax(smooth)]),
+            'smoothed_confidence': float(smooth.max())
+        })
+
+    mean_probabilities = smoothed.mean(axis=0)
+    result['prediction'] = str(class_names[np.argmax(mean_probabilities)])
+    result['confidence'] = float(mean_probabilities.max())
+    result['probabilities'] = {str(c): float(p) for c, p in zip(class_names, mean_probabilities)}
+    return result
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Classify cattle vs buffalo in a video file")
+    parser.add_argument("video", help="Path to a video file")
+    parser.add_argument("--model", default="cattle_buffalo_model",
+                        help="Model path prefix (.mmap/ artifact or .joblib)")
+    parser.add_argument("--stride", type=int, default=5, help="Classify every n-th frame")
+    parser.add_argument("--batch-size", type=int, default=32,
+                        help=f"Frames per model call (at most {MAX_BATCH_SIZE})")
+    parser.add_argument("--smoothing", type=float, default=0.3,
+                        help="EMA weight of the newest frame (1 = no smoothing)")
+    parser.add_argument("--bbox", default=None, help="Crop every frame to xmin,ymin,xmax,ymax")
+    parser.add_argument("--output", default=None, help="Write the full result as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Classify a video from the command line"""
+    args = parse_args(argv)
+
+    model, source = load_model_file(args.model)
+    if model is None:
+        print(f"❌ Model not found: {args.model}")
+        return 1
+    profile = load_metadata(args.model).get('feature_profile', DEFAULT_PROFILE)
+    bbox = [int(v) for v in args.bbox.split(",")] if args.bbox else None
+
+    print(f"Classifying {args.video} with {source} (stride {args.stride}, batch {args.batch_size})")
+    try:
+        result = classify_video(
+            model, args.video, stride=args.stride, batch_size=args.batch_size,
+            alpha=args.smoothing, bbox=bbox, profile=profile
+        )
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+
+    for frame in result['frames']:
+        print(f"  frame {frame['frame']:>6} {frame['time']:>8.2f}s  {frame['prediction']:<8} "
+              f"{frame['confidence']:.2f}  smoothed {frame['smoothed_prediction']:<8} "
+              f"{frame['smoothed_confidence']:.2f}")
+
+    if result['prediction'] is None:
+        print("❌ No frames could be classified")
+    else:
+        print(f"\nPrediction: {result['prediction']} (confidence {result['confidence']:.3f})")
+    print(f"Read {result['frames_read']} frames, classified {result['frames_classified']} "
+          f"in {result['processing_seconds']:.2f}s: {result['decoded_fps']:.1f} fps decoded, "
+          f"{result['classified_fps']:.1f} fps classified, {result['realtime_factor']:.1f}x real time")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Result saved to {args.output}")
+    return 0 if result['prediction'] is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())